@@ -1,12 +1,25 @@
 # Used for building .exe to avoid showing console
 
-import main
+import multiprocessing
 import sys
 
-logfile = open(main.APPDATA_FOLDER.joinpath("log.txt"), "w")
-sys.stdout = logfile
-sys.stderr = logfile
+import config
+import instance
 
-main.start()
+if __name__ == "__main__":
+    # Worker processes import this module again, and frozen executables need this to start them.
+    multiprocessing.freeze_support()
 
-logfile.close()
+    config.makefolders()
+    # Bring the window that is already open to the front, before spending time importing the rest of the app.
+    if instance.send("show", timeout=5) is not None:
+        sys.exit(0)
+    import main
+
+    logfile = open(config.APPDATA_FOLDER.joinpath("log.txt"), "w")
+    sys.stdout = logfile
+    sys.stderr = logfile
+
+    main.start()
+
+    logfile.close()
@@ -0,0 +1,588 @@
+import hashlib
+import json
+import os
+from pathlib import Path
+import threading
+import time
+
+import diagnostics
+from filelock import FileLock
+import upk
+
+
+# Name of the map file that replaces Underpass.
+UNDERPASS = "Labs_Underpass_P.upk"
+# Bytes copied between progress updates and cancellation checks.
+CHUNK_SIZE = 8 * 1024 ** 2
+# Folder in the mods folder where maps are staged, so they are on the same volume as Underpass.
+STAGING_FOLDER = ".staging"
+# Bytes read from each end of a map to fingerprint it.
+FINGERPRINT_BYTES = 64 * 1024
+# States of the active map found by checkactive.
+CURRENT = "current"
+STALE = "stale"
+MISSING = "missing"
+REPLACED = "replaced"
+# ioctl request that clones a file's extents on Linux filesystems that support it, such as Btrfs and XFS.
+FICLONE = 0x40049409
+
+
+class CopyCancelled(Exception):
+    pass
+
+
+class ActivationError(Exception):
+    """Raised when a map can't be activated or Underpass restored. The message is shown to the user."""
+
+
+def _reflink(fsrc, fdst):
+    try:
+        import fcntl
+    except ImportError:
+        return False
+    try:
+        fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+    except OSError:
+        return False
+    return True
+
+
+def _copychunks(fsrc, fdst, total, progress, cancel, chunk):
+    infd = fsrc.fileno()
+    outfd = fdst.fileno()
+    methods = []
+    if hasattr(os, "copy_file_range"):
+        methods.append(lambda n: os.copy_file_range(infd, outfd, n))
+    if hasattr(os, "sendfile"):
+        methods.append(lambda n: os.sendfile(outfd, infd, None, n))
+    buf = bytearray(chunk)
+    view = memoryview(buf)
+
+    def readinto(n):
+        read = fsrc.readinto(view[:n])
+        fdst.write(view[:read])
+        return read
+
+    methods.append(readinto)
+
+    done = 0
+    method = methods.pop(0)
+    while done < total:
+        if cancel is not None and cancel.is_set():
+            raise CopyCancelled
+        try:
+            n = method(min(chunk, total - done))
+        except OSError:
+            # The kernel can refuse to copy between some filesystems. Fall back before anything has been copied.
+            if done or not methods:
+                raise
+            method = methods.pop(0)
+            continue
+        if not n:
+            # copy_file_range copies nothing rather than failing between some filesystems, so try the next method.
+            # The last one only reads nothing if the map was cut short while it was being copied.
+            if not methods:
+                raise OSError(f"Copied only {done} of {total} bytes")
+            method = methods.pop(0)
+            continue
+        done += n
+        if progress is not None:
+            progress(done, total)
+
+
+def copy_file(src, dst, progress=None, cancel=None, chunk=CHUNK_SIZE):
+    """Copy the file 'src' to 'dst' using the fastest method available.
+
+    Tries cloning the file (reflink) first, then copying in the kernel with copy_file_range or sendfile, and falls
+    back to copying through a large buffer. 'progress(done, total)' is called after each chunk is copied.
+    Raises CopyCancelled if the threading.Event 'cancel' is set before the copy finishes.
+    """
+
+    start = time.perf_counter()
+    with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+        total = os.fstat(fsrc.fileno()).st_size
+        method = "reflink"
+        if total and not _reflink(fsrc, fdst):
+            method = "chunks"
+            _copychunks(fsrc, fdst, total, progress, cancel, chunk)
+        if progress is not None:
+            progress(total, total)
+    diagnostics.record("copy", time.perf_counter() - start, bytes=total, method=method)
+
+
+def _tmppath(path):
+    """Return the path of a temporary file next to 'path', used only by the calling thread of this process.
+
+    The window and the command line can replace the same file at once, so each needs its own temporary file.
+    """
+
+    path = Path(path)
+    return path.with_name(f"{path.name}.{os.getpid()}-{threading.get_ident()}.part")
+
+
+def copymap(src, dest, progress=None, cancel=None):
+    """Copy the map 'src' to 'dest' through a temporary file, so 'dest' is only replaced by a complete copy.
+
+    Arguments are passed on to copy_file. The temporary file is removed if the copy fails or is cancelled.
+    """
+
+    tmp_path = _tmppath(dest)
+    try:
+        copy_file(src, tmp_path, progress, cancel)
+        os.replace(tmp_path, dest)
+    except BaseException:
+        try:
+            tmp_path.unlink()
+        except OSError:
+            pass
+        raise
+
+
+class Staging:
+    """Maps kept ready to activate in a folder on the same volume as the mods folder.
+
+    A map is staged as a hard link to it where possible, and as a copy otherwise. Activating a staged map links it
+    into the mods folder and renames the link over Underpass with os.replace, which is atomic and takes the same time
+    whatever the size of the map. Copies are kept until their total size goes over 'max_bytes', then the least
+    recently used are deleted. Hard links take no space of their own. Staged maps whose source has changed or been
+    deleted are dropped when the folder is opened.
+
+    A map staged as a hard link is the same file as the map in the workshop folder, and so is Underpass once it's
+    activated, so all three show a link count of 3. Steam and the game replace maps rather than write into them, so
+    this only matters to tools that edit Underpass in place, which would change the workshop map too. Setting
+    StagingMB to 0 copies maps instead.
+
+    The window and the command line can stage maps in the same folder at once, so the metadata file is read again
+    and written back while holding LOCK whenever it changes. Copies are made to temporary files of their own outside
+    the lock, and only renamed into place while holding it. Use openstaging to share one instance per folder between
+    the threads of a process.
+    """
+
+    METADATA = "staging.json"
+    LOCK = "staging.lock"
+    # Seconds a temporary file can go unchanged before it's taken to be left by an interrupted copy, and deleted.
+    PART_TIMEOUT = 600
+
+    def __init__(self, folder, max_bytes=1024 ** 3):
+        self.folder = Path(folder)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self.folder.mkdir(exist_ok=True)
+        self._filelock = FileLock(self.folder.joinpath(self.LOCK))
+        self._load()
+
+    def _read(self):
+        """Return the metadata saved in the folder. Called with both locks held.
+
+        Maps staged file names to their source, the source's size and modification time, when they were last used,
+        and whether they are copies.
+        """
+
+        try:
+            with open(self.folder.joinpath(self.METADATA)) as file:
+                meta = json.load(file)
+        except (OSError, ValueError):
+            return {}
+        return meta if isinstance(meta, dict) else {}
+
+    def _write(self, meta):
+        path = self.folder.joinpath(self.METADATA)
+        tmp_path = path.with_name(self.METADATA + ".tmp")
+        with open(tmp_path, "w") as file:
+            json.dump(meta, file)
+        os.replace(tmp_path, path)
+
+    def _load(self):
+        with self._lock, self._filelock:
+            meta = self._read()
+            current = {}
+            for name, info in meta.items():
+                try:
+                    stat = os.stat(info["source"])
+                    fresh = stat.st_size == info["size"] and stat.st_mtime_ns == info["mtime"]
+                except (OSError, KeyError, TypeError):
+                    fresh = False
+                if fresh and self.folder.joinpath(name).exists():
+                    current[name] = info
+            # Delete staged files that are stale or unknown, and temporary files left by an interrupted copy. Those
+            # still being written to may belong to a copy running in another process.
+            now = time.time()
+            with os.scandir(self.folder) as it:
+                for entry in it:
+                    try:
+                        if entry.name.endswith(".staged") and entry.name not in current:
+                            os.remove(entry.path)
+                        elif entry.name.endswith(".part") and now - entry.stat().st_mtime > self.PART_TIMEOUT:
+                            os.remove(entry.path)
+                    except OSError:
+                        pass
+            if current.keys() != meta.keys():
+                self._write(current)
+
+    @property
+    def nbytes(self):
+        with self._lock, self._filelock:
+            meta = self._read()
+        return sum(info["size"] for info in meta.values() if info["copy"])
+
+    def _name(self, src, stat):
+        key = f"{os.path.abspath(src)}|{stat.st_size}|{stat.st_mtime_ns}"
+        return hashlib.blake2b(key.encode(), digest_size=16).hexdigest() + ".staged"
+
+    def stage(self, src, progress=None, cancel=None):
+        """Stage the map 'src' if it isn't already, and return the path of the staged file.
+
+        Copies with copy_file if a hard link can't be made, passing 'progress' and 'cancel' on to it.
+        """
+
+        stat = os.stat(src)
+        name = self._name(src, stat)
+        path = self.folder.joinpath(name)
+        with self._lock, self._filelock:
+            meta = self._read()
+            info = meta.get(name)
+            if info is not None and path.exists():
+                info["used"] = time.time()
+                self._write(meta)
+                return path
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
+            try:
+                os.link(src, path)
+            except OSError:
+                pass
+            else:
+                self._add(meta, src, stat, name, copy=False)
+                return path
+        tmp_path = _tmppath(path)
+        try:
+            copy_file(src, tmp_path, progress, cancel)
+            with self._lock, self._filelock:
+                os.replace(tmp_path, path)
+                self._add(self._read(), src, stat, name, copy=True)
+        except BaseException:
+            try:
+                tmp_path.unlink()
+            except OSError:
+                pass
+            raise
+        return path
+
+    def _add(self, meta, src, stat, name, copy):
+        """Record the map 'src' as staged under 'name', and write the metadata. Called with both locks held."""
+
+        # Drop older versions of the same map.
+        source = str(os.path.abspath(src))
+        for old in [n for n, i in meta.items() if i["source"] == source and n != name]:
+            self._remove(meta, old)
+        meta[name] = {
+            "source": source, "size": stat.st_size, "mtime": stat.st_mtime_ns, "used": time.time(), "copy": copy
+        }
+        self._evict(meta, keep=name)
+        self._write(meta)
+
+    def activate(self, src, dest, progress=None, cancel=None):
+        """Replace 'dest' with the map 'src' in one atomic rename, staging the map first if needed.
+
+        The staged file is hard linked next to 'dest' and renamed over it, so the staged copy is kept. If the volume
+        doesn't support hard links, the staged file is copied next to 'dest' instead, and then renamed.
+        """
+
+        staged = self.stage(src, progress, cancel)
+        dest = Path(dest)
+        tmp_path = _tmppath(dest)
+        try:
+            tmp_path.unlink()
+        except FileNotFoundError:
+            pass
+        # Linked while holding the lock, so another process can't evict the staged file first.
+        with self._lock, self._filelock:
+            try:
+                os.link(staged, tmp_path)
+                linked = True
+            except OSError:
+                linked = False
+        if linked:
+            os.replace(tmp_path, dest)
+        else:
+            copymap(staged, dest, progress, cancel)
+
+    def _remove(self, meta, name):
+        try:
+            self.folder.joinpath(name).unlink()
+        except FileNotFoundError:
+            pass
+        except OSError:
+            return
+        del meta[name]
+
+    def _evict(self, meta, keep=None):
+        total = sum(info["size"] for info in meta.values() if info["copy"])
+        for name in sorted(meta, key=lambda n: meta[n]["used"]):
+            if total <= self.max_bytes:
+                break
+            info = meta[name]
+            if name == keep or not info["copy"]:
+                continue
+            self._remove(meta, name)
+            if name not in meta:
+                total -= info["size"]
+
+
+_stagings = {}
+_stagings_lock = threading.Lock()
+
+
+def openstaging(mods_dir, max_bytes):
+    """Return the Staging in the mods folder 'mods_dir', keeping up to 'max_bytes' of copies.
+
+    The same instance is returned for the same folder for as long as the process runs, so the staging folder is only
+    scanned once, and all activations in the process share it.
+    """
+
+    folder = Path(os.path.abspath(mods_dir)).joinpath(STAGING_FOLDER)
+    with _stagings_lock:
+        staging = _stagings.get(folder)
+        if staging is None:
+            staging = _stagings[folder] = Staging(folder, max_bytes)
+        staging.max_bytes = max_bytes
+        return staging
+
+
+def readmanifest(path):
+    """Return the manifest of the last activation saved at 'path', or None if there isn't a valid one."""
+
+    try:
+        with open(path) as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return None
+
+
+def fingerprint(path):
+    """Return a hex digest of the size and the first and last FINGERPRINT_BYTES of the file at 'path'.
+
+    The package summary at the start of a map changes whenever the map is saved again, so this tells versions of a
+    map apart while reading at most 128 KB of it.
+    """
+
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as file:
+        size = os.fstat(file.fileno()).st_size
+        digest.update(str(size).encode())
+        digest.update(file.read(FINGERPRINT_BYTES))
+        if size > FINGERPRINT_BYTES:
+            file.seek(max(size - FINGERPRINT_BYTES, FINGERPRINT_BYTES))
+            digest.update(file.read(FINGERPRINT_BYTES))
+    return digest.hexdigest()
+
+
+def _savemanifest(path, manifest):
+    tmp_path = Path(path).with_suffix(".tmp")
+    with open(tmp_path, "w") as file:
+        json.dump(manifest, file)
+    os.replace(tmp_path, path)
+
+
+def writemanifest(path, src, dest, mode):
+    """Record that 'dest' was activated from the map 'src', by copying or symlinking as given by 'mode'."""
+
+    stat = os.stat(src)
+    dest_stat = os.lstat(dest)
+    manifest = {
+        "source": str(src),
+        "dest": str(dest),
+        "mode": mode,
+        "size": stat.st_size,
+        "mtime": stat.st_mtime_ns,
+        "fingerprint": fingerprint(src),
+        "dest_size": dest_stat.st_size,
+        "dest_mtime": dest_stat.st_mtime_ns,
+    }
+    _savemanifest(path, manifest)
+
+
+def clearmanifest(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def isactive(manifest, src, dest, mode):
+    """Return True if 'dest' already holds the map 'src', going by the manifest of the last activation.
+
+    Compares sizes and modification times, so neither file is read.
+    """
+
+    if manifest is None:
+        return False
+    try:
+        stat = os.stat(src)
+        dest_stat = os.lstat(dest)
+    except OSError:
+        return False
+    return (
+        manifest.get("source") == str(src)
+        and manifest.get("dest") == str(dest)
+        and manifest.get("mode") == mode
+        and manifest.get("size") == stat.st_size
+        and manifest.get("mtime") == stat.st_mtime_ns
+        and manifest.get("dest_size") == dest_stat.st_size
+        and manifest.get("dest_mtime") == dest_stat.st_mtime_ns
+    )
+
+
+def checkactive(manifest_path):
+    """Check whether the active map still matches its source, going by the manifest at 'manifest_path'.
+
+    Returns a (state, manifest) pair. 'state' is None if no map is active, CURRENT if Underpass holds the current
+    version of its source, STALE if the source has changed since, MISSING if the source is gone, or REPLACED if
+    Underpass was changed or deleted by something else. Sizes and modification times are compared first, and the
+    source is only fingerprinted if they differ. If its contents turn out to be the same, the manifest is updated, so
+    later checks only need to stat it again.
+    """
+
+    manifest = readmanifest(manifest_path)
+    if manifest is None:
+        return None, None
+    try:
+        dest_stat = os.lstat(manifest["dest"])
+    except OSError:
+        return REPLACED, manifest
+    try:
+        stat = os.stat(manifest["source"])
+    except OSError:
+        return MISSING, manifest
+    # A map activated through a hard link changes along with its source.
+    linked = os.path.samestat(stat, dest_stat)
+    if not linked and (
+        dest_stat.st_size != manifest.get("dest_size") or dest_stat.st_mtime_ns != manifest.get("dest_mtime")
+    ):
+        return REPLACED, manifest
+    if manifest.get("mode") == "symlink":
+        return CURRENT, manifest
+    if stat.st_size == manifest.get("size") and stat.st_mtime_ns == manifest.get("mtime"):
+        return CURRENT, manifest
+    if not linked:
+        try:
+            if fingerprint(manifest["source"]) != manifest.get("fingerprint"):
+                return STALE, manifest
+        except OSError:
+            return MISSING, manifest
+    manifest["size"] = stat.st_size
+    manifest["mtime"] = stat.st_mtime_ns
+    manifest["dest_size"] = dest_stat.st_size
+    manifest["dest_mtime"] = dest_stat.st_mtime_ns
+    if linked:
+        manifest["fingerprint"] = fingerprint(manifest["source"])
+    _savemanifest(manifest_path, manifest)
+    return CURRENT, manifest
+
+
+def syncactive(manifest_path, staging_bytes=0, progress=None, cancel=None):
+    """Copy the source of the active map over Underpass again if it's STALE, and update the manifest.
+
+    Copies through a Staging of 'staging_bytes' next to Underpass if that isn't 0, passing 'progress' and 'cancel'
+    on to the copy. Returns the (state, manifest) pair found by checkactive before syncing. Raises ActivationError if
+    the new version of the map is damaged, in which case the old one stays active.
+    """
+
+    state, manifest = checkactive(manifest_path)
+    if state != STALE:
+        return state, manifest
+    src, dest = manifest["source"], Path(manifest["dest"])
+    checksource(src)
+    if staging_bytes:
+        openstaging(dest.parent, staging_bytes).activate(src, dest, progress, cancel)
+    else:
+        copymap(src, dest, progress, cancel)
+    writemanifest(manifest_path, src, dest, "copy")
+    diagnostics.count("activation.resync")
+    return state, readmanifest(manifest_path)
+
+
+def checkmodsdir(path):
+    """Return 'path' as a Path if it's an existing folder called 'mods'. Raises ActivationError otherwise."""
+
+    path = Path(path)
+    try:
+        is_dir = path.is_dir()
+    except OSError:
+        is_dir = False
+    if not is_dir:
+        raise ActivationError("Invalid path: Mods path given is not a real directory")
+    if path.name.lower() != "mods":
+        raise ActivationError("Invalid path: Mods path must lead to a folder called 'mods'")
+    return path
+
+
+def checksource(src):
+    """Raise ActivationError unless 'src' is an existing map whose package header is intact.
+
+    Only the start of the file is read, so damaged maps, such as those from an interrupted download, are caught before
+    they're copied.
+    """
+
+    if not src:
+        raise ActivationError("Cannot activate: No map selected")
+    if not Path(src).is_file():
+        raise ActivationError("Cannot activate: File not found")
+    try:
+        upk.readheader(src)
+    except upk.PackageError as e:
+        raise ActivationError(f"Cannot activate: Map is damaged. {e}.")
+    except OSError as e:
+        raise ActivationError(f"Cannot activate: Couldn't read map. Full Python exception:\n{repr(e)}")
+
+
+def symlinkmap(src, dest):
+    """Replace 'dest' with a symlink to the map 'src'. Raises ActivationError if the symlink can't be created."""
+
+    dest = Path(dest)
+    if dest.exists():
+        dest.unlink()
+    try:
+        dest.symlink_to(src)
+    except OSError as e:
+        raise ActivationError(f"Couldn't create symlink. Full Python exception:\n{repr(e)}")
+
+
+def activatemap(src, mods_dir, manifest_path, symlink=False, progress=None, cancel=None, staging=None):
+    """Activate the map 'src' by copying or symlinking it over Underpass in 'mods_dir', and record it in the manifest.
+
+    Copies through the Staging 'staging' if given, and through a temporary file otherwise, passing 'progress' and
+    'cancel' on to copy_file.
+    Returns False without doing anything if the manifest shows the map is already active, and True otherwise.
+    Raises ActivationError if the map or mods folder isn't valid.
+    """
+
+    checksource(src)
+    dest = checkmodsdir(mods_dir).joinpath(UNDERPASS)
+    mode = "symlink" if symlink else "copy"
+    if isactive(readmanifest(manifest_path), src, dest, mode):
+        return False
+    if symlink:
+        symlinkmap(src, dest)
+    elif staging is not None:
+        staging.activate(src, dest, progress, cancel)
+    else:
+        copymap(src, dest, progress, cancel)
+    writemanifest(manifest_path, src, dest, mode)
+    return True
+
+
+def restore(mods_dir, manifest_path):
+    """Delete the map replacing Underpass from 'mods_dir', and clear the manifest.
+
+    Returns False if Underpass was already restored. Raises ActivationError if the mods folder isn't valid.
+    """
+
+    dest = checkmodsdir(mods_dir).joinpath(UNDERPASS)
+    if not dest.exists():
+        return False
+    dest.unlink()
+    clearmanifest(manifest_path)
+    return True
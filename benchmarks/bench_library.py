@@ -0,0 +1,247 @@
+"""Measure the hot paths of RLMapLoader against synthetic workshop libraries and a local stand-in for Steam.
+
+Run from the repository root with 'python -m benchmarks.bench_library'. Covers scanning the workshop folder
+(scanwkfiles) and reading package headers (inspectmaps), filtering the list while typing (fillwslist), loading
+previews cold and warm (changeimg, through the same loader the window uses on its worker threads), fetching and
+parsing workshop pages (WorkshopItem) and activating maps (copytolabs). Nothing needs a display or the internet.
+Results are printed as JSON, and can be saved with --output to compare against a baseline.
+"""
+
+import argparse
+from collections import OrderedDict
+import json
+import os
+from pathlib import Path
+import platform
+import shutil
+import sys
+import tempfile
+import time
+
+import activate
+from benchmarks.fixtures import make_library, map_data, preview_image
+from benchmarks.steamserver import FakeSteam
+from cache import DiskCache
+from search import SearchIndex
+import upk
+from wkindex import WorkshopIndex
+
+
+SIZES = (100, 10000, 100000)
+# Size that thumbnails are made at, as in the window.
+IMG_SIZE = (240, 158)
+# Text typed into the search box, one character at a time.
+TYPED = "map_12"
+
+
+def best(func, repeat):
+    """Return the shortest time in seconds that 'func()' took over 'repeat' calls."""
+
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def each(func, items):
+    """Call 'func(item)' for each item, returning the mean and slowest time per item in seconds."""
+
+    times = []
+    for item in items:
+        start = time.perf_counter()
+        func(item)
+        times.append(time.perf_counter() - start)
+    return {"mean_s": sum(times) / len(times), "max_s": max(times)} if times else {}
+
+
+def bench_scan(folder, index_path, repeat):
+    """Time scanning a library into a new index, rescanning it unchanged, rescanning it after one change, and
+    reading the package headers of all its maps.
+    """
+
+    results = {}
+    if index_path.exists():
+        index_path.unlink()
+    index = WorkshopIndex(index_path)
+    try:
+        start = time.perf_counter()
+        index.rescan(folder)
+        entries = index.getmaps(folder)
+        results["cold_s"] = time.perf_counter() - start
+        results["maps"] = len(entries)
+        results["warm_s"] = best(lambda: (index.rescan(folder), index.getmaps(folder)), repeat)
+        changed = entries[len(entries) // 2].path.with_name("added.udk")
+
+        def one_changed():
+            changed.write_bytes(b"")
+            os.utime(changed.parent, ns=(time.time_ns(), time.time_ns()))
+            index.rescan(folder)
+            index.getmaps(folder)
+            changed.unlink()
+            index.rescan(folder)
+
+        results["one_changed_s"] = best(one_changed, repeat) / 2
+        start = time.perf_counter()
+        unread = index.uninspected(folder)
+        index.putheaders(unread, {e.path: upk.inspect(e.path) for e in unread})
+        results["inspect_s"] = time.perf_counter() - start
+    finally:
+        index.close()
+    return results, entries
+
+
+def bench_filter(entries, titles, repeat):
+    """Time building the search index, and filtering the list for each keystroke of TYPED."""
+
+    texts = [f"{e.name}\n{titles.get(e.path.parent.name, '')}" for e in entries]
+    results = {"build_s": best(lambda: SearchIndex(texts), repeat)}
+    search_index = SearchIndex(texts)
+
+    def filterlist(query):
+        # The same work fillwslist does before filling the listbox.
+        return OrderedDict((entries[i].path, entries[i]) for i in search_index.search(query))
+
+    def typing():
+        for n in range(1, len(TYPED) + 1):
+            filterlist(TYPED[:n])
+
+    results["keystroke_s"] = best(typing, repeat) / len(TYPED)
+    results["matches"] = len(filterlist(TYPED))
+    return results
+
+
+def bench_previews(entries, workdir, steam, samples):
+    """Time loading previews from map folders and from the stand-in for Steam, with empty and filled caches."""
+
+    from thumbs import loadpreview
+
+    step = max(len(entries) // samples, 1)
+    local = [e for e in entries[::step] if e.preview is not None][:samples]
+    remote = [e for e in entries[::step] if e.preview is None][:samples]
+    index = WorkshopIndex(":memory:")
+
+    def newcache(name):
+        folder = Path(workdir, name)
+        shutil.rmtree(folder, ignore_errors=True)
+        folder.mkdir()
+        return DiskCache(folder)
+
+    cache = newcache("imgcache")
+
+    def load(entry):
+        loadpreview(entry, IMG_SIZE, cache, index, base_url=steam.base_url)
+
+    try:
+        requests_before = steam.requests
+        results = {
+            "local_cold": each(load, local),
+            "local_warm": each(load, local),
+            "remote_cold": each(load, remote),
+            "remote_warm": each(load, remote),
+        }
+        # With the image URL known from the index, only the image is downloaded.
+        cache = newcache("imgcache_known")
+        results["remote_known_url"] = each(load, remote)
+        results["requests"] = steam.requests - requests_before
+    finally:
+        index.close()
+    return results
+
+
+def bench_workshop_item(steam, ids, repeat):
+    """Time fetching and parsing workshop pages from the stand-in for Steam, and revalidating them."""
+
+    from scraper import WorkshopItem, make_session
+
+    session = make_session()
+    items = {}
+
+    def fetch(_id):
+        items[_id] = WorkshopItem(_id, session=session, base_url=steam.base_url)
+
+    def revalidate(_id):
+        WorkshopItem(_id, session=session, base_url=steam.base_url, cached=items[_id].info)
+
+    results = {"fetch": min((each(fetch, ids) for _ in range(repeat)), key=lambda r: r["mean_s"])}
+    results["revalidate"] = min((each(revalidate, ids) for _ in range(repeat)), key=lambda r: r["mean_s"])
+    return results
+
+
+def bench_copy(workdir, size_mb, repeat):
+    """Time activating a map of 'size_mb' megabytes by copying, and checking a map that is already active."""
+
+    src = Path(workdir, "copy_src", "big.udk")
+    src.parent.mkdir(exist_ok=True)
+    if not src.exists() or src.stat().st_size != size_mb * 1024 ** 2:
+        with open(src, "wb") as file:
+            # Maps must start with a valid package header to be activated.
+            file.write(map_data(0, 1024 ** 2))
+            block = os.urandom(1024 ** 2)
+            for _ in range(size_mb - 1):
+                file.write(block)
+    mods_dir = Path(workdir, "mods")
+    mods_dir.mkdir(exist_ok=True)
+    manifest = Path(workdir, "activation.json")
+
+    def copy():
+        activate.clearmanifest(manifest)
+        activate.activatemap(src, mods_dir, manifest)
+
+    seconds = best(copy, repeat)
+    results = {"size_mb": size_mb, "copy_s": seconds, "copy_mb_per_s": size_mb / seconds}
+    results["already_active_s"] = best(lambda: activate.activatemap(src, mods_dir, manifest), repeat)
+    activate.restore(mods_dir, manifest)
+    return results
+
+
+def run(workdir, sizes=SIZES, repeat=3, samples=20, copy_mb=256, latency=0.0):
+    image = preview_image()
+    results = {
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "libraries": {},
+    }
+    with FakeSteam(image, latency=latency) as steam:
+        for count in sizes:
+            folder = Path(workdir, f"library_{count}")
+            start = time.perf_counter()
+            ids = make_library(folder, count, image=image)
+            library = {"make_s": time.perf_counter() - start}
+            library["scan"], entries = bench_scan(folder, Path(workdir, f"index_{count}.db"), repeat)
+            titles = {_id: f"Map {_id}" for _id in ids}
+            library["filter"] = bench_filter(entries, titles, repeat)
+            library["preview"] = bench_previews(entries, workdir, steam, samples)
+            results["libraries"][str(count)] = library
+        results["workshop_item"] = bench_workshop_item(steam, ids[:samples], repeat)
+    if copy_mb:
+        results["copy"] = bench_copy(workdir, copy_mb, repeat)
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--sizes", type=lambda s: [int(n) for n in s.split(",")], default=SIZES,
+        help="comma separated numbers of maps in the synthetic libraries",
+    )
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--samples", type=int, default=20, help="number of previews and pages loaded per library")
+    parser.add_argument("--copy-mb", type=int, default=256, help="size of the map copied, or 0 to skip copying")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to each response from the server")
+    parser.add_argument("--workdir", help="folder to keep the libraries in between runs, instead of a temporary one")
+    parser.add_argument("--output", help="also write the results to this file")
+    args = parser.parse_args()
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="rlmaploader-bench-")
+    Path(workdir).mkdir(parents=True, exist_ok=True)
+    try:
+        results = run(workdir, args.sizes, args.repeat, args.samples, args.copy_mb, args.latency)
+    finally:
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+    text = json.dumps(results, indent=2)
+    print(text)
+    if args.output:
+        Path(args.output).write_text(text)
@@ -0,0 +1,67 @@
+"""Compare workshop page extraction against a full BeautifulSoup parse.
+
+Run from the repository root with 'python -m benchmarks.bench_scraper', after installing the benchmark requirements
+with 'pip install -r benchmarks/requirements.txt'. The BeautifulSoup comparison is skipped, with a note in the results,
+if bs4 and lxml aren't installed.
+"""
+
+import argparse
+import json
+import re
+import time
+import tracemalloc
+
+from benchmarks.fixtures import workshop_page
+from scraper import parse_item
+
+
+def soup_item(_id, page):
+    """Extract the same details the way the scraper used to, by parsing the whole page."""
+
+    from bs4 import BeautifulSoup
+
+    soup = BeautifulSoup(page, "lxml")
+    title = soup.find("div", class_="workshopItemTitle").text
+    javascript = soup.find("img", class_="workshopItemPreviewImageEnlargeable").parent["onclick"]
+    pattern = re.compile(r"ShowEnlargedImagePreview\(\s*'(?P<url>.+)'\s*\);")
+    return soup, title, pattern.match(javascript)["url"]
+
+
+def measure(func, pages, repeat):
+    """Return the best time per page in seconds, and the peak memory allocated while parsing one page."""
+
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _id, page in pages:
+            func(_id, page)
+        best = min(best, (time.perf_counter() - start) / len(pages))
+    tracemalloc.start()
+    result = func(*pages[0])  # noqa
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return best, peak
+
+
+def run(count=20, repeat=5):
+    pages = [
+        (str(i), workshop_page(str(i), f"Map {i}", f"https://steamuserimages-a.akamaihd.net/ugc/{i}/", seed=i))
+        for i in range(count)
+    ]
+    results = {"page_bytes": len(pages[0][1])}
+    results["parse_item_s"], results["parse_item_peak_bytes"] = measure(parse_item, pages, repeat)
+    try:
+        results["soup_s"], results["soup_peak_bytes"] = measure(soup_item, pages, repeat)
+    except ImportError:
+        results["soup_skipped"] = "bs4 and lxml aren't installed, see benchmarks/requirements.txt"
+    else:
+        results["speedup"] = results["soup_s"] / results["parse_item_s"]
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--count", type=int, default=20, help="number of pages to parse")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    print(json.dumps(run(args.count, args.repeat), indent=2))
@@ -0,0 +1,120 @@
+"""Check fetching workshop items in batches end to end, against a local stand-in for Steam.
+
+Run from the repository root with 'python -m benchmarks.check_fetch'. Checks that fetch_items keeps 'workers'
+requests going at once, that warmcache retries server errors, stores what it fetched, and records items that don't
+exist so the next run skips them. Nothing needs a display or the internet. Exits with status 1 if a check fails.
+"""
+
+import argparse
+from pathlib import Path
+import shutil
+import sys
+import tempfile
+import time
+
+from benchmarks.fixtures import FIRST_ID, make_library, preview_image
+from benchmarks.steamserver import FakeSteam
+from cache import DiskCache
+import scraper
+from warmcache import warmcache
+from wkindex import WorkshopIndex
+
+
+# Size that thumbnails are made at, as in the window.
+IMG_SIZE = (240, 158)
+
+
+class CheckFailed(Exception):
+    pass
+
+
+def expect(condition, message):
+    if not condition:
+        raise CheckFailed(message)
+
+
+def check_concurrency(image, count=16, workers=4, latency=0.1):
+    """Fetch 'count' items 'workers' at a time from a server that takes 'latency' seconds to answer each request."""
+
+    ids = [str(FIRST_ID + i) for i in range(count)]
+    with FakeSteam(image, latency=latency) as steam:
+        start = time.perf_counter()
+        results = dict(scraper.fetch_items(ids, workers=workers, base_url=steam.base_url))
+        elapsed = time.perf_counter() - start
+    expect(sorted(results) == ids, f"fetched {sorted(results)}, expected {ids}")
+    expect(all(item is not None and item.title == f"Map {_id}" for _id, item in results.items()), "items are wrong")
+    expect(steam.max_active == workers, f"{steam.max_active} requests ran at once, expected {workers}")
+    serial = count * latency
+    expect(elapsed < serial / 2, f"took {elapsed:.2f} s, while one at a time takes {serial:.2f} s")
+    return {"elapsed_s": elapsed, "max_active": steam.max_active}
+
+
+def check_warmcache(image, workdir):
+    """Warm the caches for a small library twice, checking what was fetched, stored and skipped.
+
+    One item doesn't exist, one only answers on its last retry, and one keeps failing.
+    """
+
+    folder = Path(workdir, "library")
+    ids = make_library(folder, 6, preview_every=0)
+    missing, flaky, down = ids[:3]
+    failures = {flaky: scraper.RETRIES, down: 2 * (scraper.RETRIES + 1)}
+    index = WorkshopIndex(Path(workdir, "index.db"))
+    Path(workdir, "cache").mkdir()
+    cache = DiskCache(Path(workdir, "cache"))
+    try:
+        index.rescan(folder)
+        entries = index.getmaps(folder)
+        with FakeSteam(image, missing=[missing], failures=failures) as steam:
+            count = warmcache(entries, cache, IMG_SIZE, index, workers=4, base_url=steam.base_url)
+            expect(count == len(ids) - 2, f"fetched {count} items, expected {len(ids) - 2}")
+            for _id in ids[3:] + [flaky]:
+                item = index.getitem(_id)
+                expect(item is not None and item.title == f"Map {_id}", f"details of {_id} weren't stored")
+                expect(_id in cache, f"preview of {_id} wasn't cached")
+            expect(steam.pages[flaky] == scraper.RETRIES + 1, f"{flaky} was tried {steam.pages[flaky]} times")
+            item = index.getitem(missing)
+            expect(item is not None and item.title is None, f"{missing} wasn't recorded as not found")
+            expect(index.getitem(down) is None, f"{down} was recorded, though Steam couldn't be reached")
+
+            pages = steam.pages.copy()
+            count = warmcache(entries, cache, IMG_SIZE, index, workers=4, base_url=steam.base_url)
+            expect(count == 0, f"fetched {count} items again, expected none")
+            expect(steam.pages[missing] == pages[missing], f"{missing} was looked up again within NOT_FOUND_TTL")
+            expect(steam.pages[down] > pages[down], f"{down} wasn't tried again")
+            expect(all(steam.pages[_id] == pages[_id] for _id in ids[3:]), "items already cached were fetched again")
+    finally:
+        cache.close()
+        index.close()
+    return {"requests": steam.requests}
+
+
+def run(workdir):
+    image = preview_image(size=(640, 360))
+    results = {}
+    failed = []
+    for name, check in (
+        ("concurrency", lambda: check_concurrency(image)),
+        ("warmcache", lambda: check_warmcache(image, workdir)),
+    ):
+        try:
+            results[name] = check()
+        except CheckFailed as e:
+            failed.append(f"{name}: {e}")
+    return results, failed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="rlmaploader-check-")
+    try:
+        results, failed = run(workdir)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    for name, result in results.items():
+        print(f"ok      {name} {result}")
+    for failure in failed:
+        print(f"FAILED  {failure}")
+    sys.exit(1 if failed else 0)
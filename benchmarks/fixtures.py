@@ -0,0 +1,149 @@
+"""Synthetic Steam workshop pages and workshop folders for benchmarks.
+
+Pages follow the markup of real workshop item pages around the elements the scraper reads, padded with the kind of
+navigation, script and comment markup that makes up most of a real page. Workshop folders are laid out like Steam's,
+with a folder per workshop ID holding a map and, for some maps, a preview image.
+"""
+
+import html
+from io import BytesIO
+import json
+import os
+from pathlib import Path
+import random
+import struct
+
+
+# Signature at the start of Unreal package files, such as '.udk' maps.
+PACKAGE_TAG = 0x9E2A83C1
+# First workshop ID used for synthetic map folders.
+FIRST_ID = 1000000000
+
+
+def workshop_page(_id, title, image_url, comments=60, seed=0):
+    """Return the HTML of a workshop item page with the given title and enlarged preview image URL."""
+
+    rng = random.Random(seed)
+    words = ["rocket", "league", "map", "workshop", "ball", "goal", "boost", "ramp", "pillar", "training"]
+
+    def text(n):
+        return " ".join(rng.choice(words) for _ in range(n))
+
+    parts = [
+        "<!DOCTYPE html>\n<html class=\"responsive\">\n<head>\n",
+        f"<title>Steam Workshop::{html.escape(title)}</title>\n",
+        "<meta http-equiv=\"Content-Type\" content=\"text/html; charset=UTF-8\">\n",
+    ]
+    for i in range(25):
+        parts.append(f"<link href=\"https://community.cloudflare.steamstatic.com/public/css/style{i}.css\" "
+                     "rel=\"stylesheet\" type=\"text/css\">\n")
+    for i in range(15):
+        parts.append("<script type=\"text/javascript\">\n")
+        parts.append("".join(f"\tvar g_{i}_{j} = {{\"k\": \"{text(6)}\", \"n\": {j}}};\n" for j in range(40)))
+        parts.append("</script>\n")
+    parts.append("</head>\n<body class=\"responsive_page\">\n<div id=\"global_header\">\n<div class=\"content\">\n")
+    for i in range(40):
+        parts.append(f"<a class=\"menuitem\" href=\"https://store.steampowered.com/menu{i}/\">{text(2)}</a>\n")
+    parts.append("</div>\n</div>\n")
+    parts.append(
+        "<div class=\"workshopItemDetailsHeader\">\n"
+        f"<div class=\"workshopItemTitle\">{html.escape(title)}</div>\n"
+        "</div>\n"
+        "<div id=\"highlight_player_area\">\n"
+        "<div class=\"workshopItemPreviewImageMain\">\n"
+        f"<a onclick=\"ShowEnlargedImagePreview( '{html.escape(image_url)}' );\">\n"
+        "<img id=\"previewImageMain\" class=\"workshopItemPreviewImageEnlargeable\" "
+        f"src=\"{html.escape(image_url)}?imw=637&amp;imh=358&amp;ima=fit\">\n"
+        "</a>\n</div>\n</div>\n"
+    )
+    parts.append(
+        f"<div class=\"workshopItemDescription\" id=\"highlightContent\">{text(300)}<br><br>{text(200)}</div>\n"
+    )
+    parts.append("<div class=\"commentthread_comments\">\n")
+    for i in range(comments):
+        parts.append(
+            f"<div class=\"commentthread_comment responsive_body_text\" id=\"comment_{_id}{i}\">\n"
+            "<div class=\"commentthread_comment_avatar playerAvatar online\">\n"
+            f"<a href=\"https://steamcommunity.com/id/user{i}\"><img src=\"https://avatars.steamstatic.com/{i}.jpg\">"
+            "</a>\n</div>\n<div class=\"commentthread_comment_content\">\n"
+            f"<div class=\"commentthread_comment_author\"><a class=\"hoverunderline commentthread_author_link\" "
+            f"href=\"https://steamcommunity.com/id/user{i}\"><bdi>user{i}</bdi></a></div>\n"
+            f"<div class=\"commentthread_comment_text\">{text(40)}</div>\n</div>\n</div>\n"
+        )
+    parts.append("</div>\n</body>\n</html>\n")
+    return "".join(parts)
+
+
+def preview_image(size=(1280, 720), quality=85, seed=0):
+    """Return the bytes of a JPEG preview image of 'size', with enough detail to be as slow to decode as a real one."""
+
+    from PIL import Image, ImageDraw
+
+    rng = random.Random(seed)
+    im = Image.linear_gradient("L").resize(size).convert("RGB")
+    draw = ImageDraw.Draw(im)
+    for _ in range(200):
+        x, y = rng.randrange(size[0]), rng.randrange(size[1])
+        r = rng.randrange(5, 80)
+        colour = tuple(rng.randrange(256) for _ in range(3))
+        draw.ellipse((x - r, y - r, x + r, y + r), fill=colour)
+    data = BytesIO()
+    im.save(data, format="JPEG", quality=quality)
+    return data.getvalue()
+
+
+def map_data(_id, size):
+    """Return the contents of a map file of 'size' bytes, starting with a valid package summary and unique to '_id'.
+
+    The ID is stored as the package's folder name, and the name, export and import tables are said to follow the
+    summary, as they do in real maps.
+    """
+
+    folder = str(_id).encode() + b"\0"
+    summary_size = struct.calcsize("<IHHii") + len(folder) + struct.calcsize("<Iiiiiii")
+    header_size = max(min(size, 1024), summary_size)
+    tables = (100, summary_size, 20, summary_size, 10, summary_size)
+    header = (
+        struct.pack("<IHHii", PACKAGE_TAG, 868, 32, header_size, len(folder))
+        + folder
+        + struct.pack("<Iiiiiii", 0, *tables)
+    )
+    return header + bytes(max(size - len(header), 0))
+
+
+def make_library(folder, count, preview_every=2, map_size=4096, image=None):
+    """Create a synthetic workshop folder with 'count' map folders in 'folder', and return the workshop IDs.
+
+    Every 'preview_every'th map folder gets a copy of the JPEG 'image' as its preview. Previews are hard links to
+    one file where the filesystem allows it, so large libraries stay small on disk. A library that was already made
+    with the same arguments is reused.
+    """
+
+    folder = Path(folder)
+    ids = [str(FIRST_ID + i) for i in range(count)]
+    marker = folder.joinpath(".library.json")
+    params = {"count": count, "preview_every": preview_every, "map_size": map_size, "image": len(image or b"")}
+    try:
+        if json.loads(marker.read_text()) == params:
+            return ids
+    except (OSError, ValueError):
+        pass
+    folder.mkdir(parents=True, exist_ok=True)
+    source = None
+    if image is not None and preview_every:
+        source = folder.joinpath(".preview.jpg")
+        source.write_bytes(image)
+    for i, _id in enumerate(ids):
+        map_folder = folder.joinpath(_id)
+        map_folder.mkdir(exist_ok=True)
+        map_folder.joinpath(f"map_{i % 997}_{_id}.udk").write_bytes(map_data(_id, map_size))
+        if source is not None and i % preview_every == 0:
+            preview = map_folder.joinpath("preview.jpg")
+            if preview.exists():
+                continue
+            try:
+                os.link(source, preview)
+            except OSError:
+                preview.write_bytes(image)
+    marker.write_text(json.dumps(params))
+    return ids
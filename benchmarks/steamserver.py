@@ -0,0 +1,123 @@
+"""Local HTTP server standing in for the Steam workshop, so benchmarks don't need the internet."""
+
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import threading
+import time
+from urllib.parse import parse_qs, urlsplit
+
+from benchmarks.fixtures import workshop_page
+
+
+# Placeholder for the workshop ID in the page template.
+ID_MARK = "@ID@"
+# Page served for items that don't exist. Like Steam's, it's a normal page without an item on it.
+MISSING_PAGE = b"<html><body><div class=\"error_ctn\">There was a problem accessing the item.</div></body></html>"
+
+
+class FakeSteam:
+    """Serve synthetic workshop pages and preview images on localhost.
+
+    Pages are served at '/sharedfiles/filedetails/?id=<id>', with their preview image at '/ugc/<id>/'. Every response
+    carries an ETag, and conditional requests that match it get a 304. 'latency' seconds are added to each response
+    to mimic a real connection. Items whose IDs are in 'missing' get the page Steam shows for items that don't exist,
+    and 'failures' maps IDs to the number of times their page is answered with a 503 before it's served.
+    The number of requests is counted in 'requests', page requests by item ID in 'pages', and the most requests
+    served at once in 'max_active'. Use as a context manager, or call start and stop.
+    """
+
+    def __init__(self, image, latency=0.0, missing=(), failures=None):
+        self.image = image
+        self.latency = latency
+        self.missing = set(missing)
+        self.failures = Counter(failures or {})
+        self.requests = 0
+        self.pages = Counter()
+        self.active = 0
+        self.max_active = 0
+        self._lock = threading.Lock()
+        self._server = None
+        self._thread = None
+        self._page = None
+
+    @property
+    def origin(self):
+        return f"http://127.0.0.1:{self._server.server_address[1]}"
+
+    @property
+    def base_url(self):
+        """Workshop page URL with %s in place of the item ID, to pass as 'base_url' to the scraper."""
+
+        return self.origin + "/sharedfiles/filedetails/?id=%s"
+
+    def start(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                with fake._lock:
+                    fake.requests += 1
+                    fake.active += 1
+                    fake.max_active = max(fake.max_active, fake.active)
+                try:
+                    self.serve()
+                finally:
+                    with fake._lock:
+                        fake.active -= 1
+
+            def serve(self):
+                if fake.latency:
+                    time.sleep(fake.latency)
+                parts = urlsplit(self.path)
+                if parts.path == "/sharedfiles/filedetails/":
+                    _id = parse_qs(parts.query).get("id", [""])[0]
+                    if not _id.isdigit():
+                        return self.reply(404, b"", "text/plain", None)
+                    with fake._lock:
+                        fake.pages[_id] += 1
+                        failing = fake.failures[_id] > 0
+                        if failing:
+                            fake.failures[_id] -= 1
+                    if failing:
+                        return self.reply(503, b"", "text/plain", None)
+                    if _id in fake.missing:
+                        return self.reply(200, MISSING_PAGE, "text/html; charset=UTF-8", None)
+                    body = fake._page.replace(ID_MARK, _id).encode()
+                    return self.reply(200, body, "text/html; charset=UTF-8", f'"page-{_id}"')
+                if parts.path.startswith("/ugc/"):
+                    return self.reply(200, fake.image, "image/jpeg", '"image"')
+                self.reply(404, b"", "text/plain", None)
+
+            def reply(self, status, body, content_type, etag):
+                if etag is not None and self.headers.get("If-None-Match") == etag:
+                    status, body = 304, b""
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                if etag is not None:
+                    self.send_header("ETag", etag)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        self._page = workshop_page(ID_MARK, f"Map {ID_MARK}", f"{self.origin}/ugc/{ID_MARK}/")
+        self._thread = threading.Thread(target=self._server.serve_forever, name="fakesteam", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
@@ -0,0 +1,410 @@
+from collections import OrderedDict
+import json
+import mmap
+import os
+from pathlib import Path
+import struct
+import threading
+import time
+import zlib
+
+from PIL import Image
+
+import diagnostics
+from filelock import FileLock
+
+
+class PhotoCache:
+    """Least recently used cache of decoded images that are ready to display.
+
+    Bounded by the number of entries and by the memory used by their pixels.
+    Only used from the Tk thread.
+    """
+
+    def __init__(self, max_entries=64, max_bytes=32 * 1024 ** 2):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self._items = OrderedDict()
+
+    def __len__(self):
+        return len(self._items)
+
+    def __contains__(self, key):
+        return key in self._items
+
+    def get(self, key):
+        """Return the image stored under 'key', or None if there isn't one."""
+
+        try:
+            self._items.move_to_end(key)
+        except KeyError:
+            diagnostics.count("photocache.miss")
+            return None
+        diagnostics.count("photocache.hit")
+        return self._items[key][0]
+
+    def put(self, key, photo):
+        """Store a PhotoImage under 'key', evicting the least recently used images if needed."""
+
+        # Tk keeps 4 bytes per pixel.
+        nbytes = photo.width() * photo.height() * 4
+        self.discard(key)
+        self._items[key] = (photo, nbytes)
+        self.nbytes += nbytes
+        while self._items and (len(self._items) > self.max_entries or self.nbytes > self.max_bytes):
+            self.nbytes -= self._items.popitem(last=False)[1][1]
+
+    def discard(self, key):
+        item = self._items.pop(key, None)
+        if item is not None:
+            self.nbytes -= item[1]
+
+    def clear(self):
+        self._items.clear()
+        self.nbytes = 0
+
+
+class DiskCache:
+    """Size-capped cache of preview thumbnails on disk, packed into a single file.
+
+    Thumbnails are appended to PACK as records holding their raw pixels, or pixels compressed with zlib at its fastest
+    level if 'compress' is set. The offset, size, last access time and hit count of each record are kept in memory,
+    and saved to INDEX by 'flush'. The pack is read through mmap, so a lookup is a dictionary hit and a slice of the
+    mapped file, with no file to open and no PNG to inflate. Raw RGBA and L pixels are used in place, and RGB pixels
+    are copied once to widen them.
+
+    When the total size goes over 'max_bytes', the least recently used records are dropped from the index, leaving
+    their space unused until the pack is compacted, which happens once over COMPACT_RATIO of it is unused. Records
+    appended since the last flush are found again by reading the pack past the end known to the index, so a crash
+    only loses access times. PNG files left by older versions are moved into the pack when they're first used.
+
+    Safe to use from several threads, and from several processes at once, such as the window and warmcache.py. Changes
+    to the pack are made while holding LOCK, after first reading any records other processes have added, and the key
+    in each record is checked when it's read.
+    """
+
+    PACK = "thumbs.pack"
+    INDEX = "thumbs.json"
+    LOCK = "thumbs.lock"
+    # Metadata file of older versions, which kept one PNG file per image.
+    LEGACY_METADATA = "index.json"
+    # Fraction of the pack that can be unused before it is compacted.
+    COMPACT_RATIO = 0.5
+    # Seconds to wait before compacting again after it failed, as it does on Windows while the pack is still mapped.
+    COMPACT_RETRY = 300
+    MAGIC = b"RLTP"
+    # Magic, flags, mode, width, height, key length and data length, followed by the key and the data.
+    RECORD = struct.Struct("<4sBx8sHHHI")
+    ZLIB = 1
+
+    def __init__(self, folder, max_bytes=200 * 1024 ** 2, compress=False):
+        self.folder = Path(folder)
+        self.max_bytes = max_bytes
+        self.compress = compress
+        self._lock = threading.Lock()
+        self._dirty = False
+        # Maps keys to [record offset, record size, last access time, hits]. The offset is None for PNG files left
+        # by older versions.
+        self._meta = {}
+        self._end = 0
+        self._map = None
+        self._file = None
+        self._filelock = FileLock(self.folder.joinpath(self.LOCK))
+        self._next_compact = 0.0
+        self._load()
+
+    def _legacypath(self, key):
+        return self.folder.joinpath(key + ".png")
+
+    def _openpack(self):
+        # Opened without truncating, since another process may have just created the pack.
+        fd = os.open(self.folder.joinpath(self.PACK), os.O_RDWR | os.O_CREAT | getattr(os, "O_BINARY", 0))
+        return open(fd, "r+b", buffering=0)
+
+    def _load(self):
+        try:
+            with open(self.folder.joinpath(self.INDEX)) as file:
+                saved = json.load(file)
+            meta, end = saved["entries"], saved["end"]
+        except (OSError, ValueError, KeyError, TypeError):
+            meta, end = {}, 0
+        with self._lock, self._filelock:
+            self._file = self._openpack()
+            size = os.fstat(self._file.fileno()).st_size
+            if end > size:
+                # The pack is shorter than the index says, so the index can't be trusted.
+                meta, end = {key: value for key, value in meta.items() if value[0] is None}, 0
+            self._meta = meta
+            self._end = end
+            self._dirty = self._recover(size)
+            self._adoptlegacy()
+            self._evict()
+            self._maybecompact()
+
+    def _sync(self):
+        """Catch up with the changes other processes have made to the pack. Called with both locks held.
+
+        Records appended since are added to the index. If the pack was compacted or deleted, it's opened again and
+        read from the start, keeping the access times of records that are still in it.
+        """
+
+        try:
+            stat = os.stat(self.folder.joinpath(self.PACK))
+        except FileNotFoundError:
+            stat = None
+        own = os.fstat(self._file.fileno())
+        if stat is not None and os.path.samestat(stat, own) and own.st_size >= self._end:
+            if self._recover(own.st_size):
+                self._dirty = True
+            return
+        self._map = None
+        self._file.close()
+        self._file = self._openpack()
+        known = self._meta
+        self._meta = {key: meta for key, meta in known.items() if meta[0] is None}
+        self._end = 0
+        self._recover(os.fstat(self._file.fileno()).st_size, known)
+        self._dirty = True
+
+    def _recover(self, size, known=None):
+        """Add the records between the end known to the index and 'size' to the index.
+
+        Only the record headers are read. Access times and hits are taken from the index entries 'known', if given.
+        Cuts the pack off at the first record that is incomplete or damaged, so it must only be called while holding
+        the file lock. Returns True if anything was found.
+        """
+
+        if self._end >= size:
+            return False
+        known = known or {}
+        now = time.time()
+        offset = self._end
+        while offset + self.RECORD.size <= size:
+            self._file.seek(offset)
+            magic, flags, mode, width, height, keylen, datalen = self.RECORD.unpack(self._file.read(self.RECORD.size))
+            length = self.RECORD.size + keylen + datalen
+            if magic != self.MAGIC or offset + length > size:
+                break
+            try:
+                key = self._file.read(keylen).decode()
+            except UnicodeDecodeError:
+                break
+            old = known.get(key)
+            self._meta[key] = [offset, length, old[2], old[3]] if old else [offset, length, now, 0]
+            offset += length
+        self._end = offset
+        if offset < size:
+            self._file.truncate(offset)
+        return True
+
+    def _adoptlegacy(self):
+        """Add the PNG files of older versions to the index, and forget those that have been deleted."""
+
+        try:
+            with open(self.folder.joinpath(self.LEGACY_METADATA)) as file:
+                legacy = json.load(file)
+        except (OSError, ValueError):
+            legacy = {}
+        found = set()
+        with os.scandir(self.folder) as it:
+            for entry in it:
+                key, ext = os.path.splitext(entry.name)
+                if ext != ".png":
+                    continue
+                found.add(key)
+                if key in self._meta:
+                    continue
+                stat = entry.stat()
+                size, atime, hits = legacy.get(key, (stat.st_size, stat.st_mtime, 0))
+                self._meta[key] = [None, stat.st_size, atime, hits]
+                self._dirty = True
+        for key in [key for key, meta in self._meta.items() if meta[0] is None and key not in found]:
+            del self._meta[key]
+            self._dirty = True
+
+    @property
+    def nbytes(self):
+        return sum(meta[1] for meta in self._meta.values())
+
+    def __contains__(self, key):
+        return key in self._meta
+
+    def _view(self, offset, length):
+        """Return a memoryview of 'length' bytes of the pack from 'offset', mapping the pack again if it has grown."""
+
+        if self._map is None or offset + length > len(self._map):
+            # Images made from the old map keep it open until they're freed.
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        return memoryview(self._map)[offset:offset + length]
+
+    def get(self, key):
+        """Return the image stored under 'key', or None if there isn't one.
+
+        Keys that aren't in the index are looked for in records added by other processes since it was last read.
+        """
+
+        with self._lock:
+            meta = self._meta.get(key)
+            if meta is None:
+                with self._filelock:
+                    self._sync()
+                meta = self._meta.get(key)
+            if meta is None:
+                diagnostics.count("diskcache.miss")
+                return None
+            meta[2] = time.time()
+            meta[3] += 1
+            self._dirty = True
+            if meta[0] is not None:
+                record = self._view(meta[0], meta[1])
+        if meta[0] is None:
+            return self._getlegacy(key)
+        magic, flags, mode, width, height, keylen, datalen = self.RECORD.unpack_from(record)
+        stored = record[self.RECORD.size:self.RECORD.size + keylen]
+        data = record[self.RECORD.size + keylen:]
+        mode = mode.rstrip(b"\0").decode()
+        try:
+            # The index may be out of date if another process compacted the pack.
+            if magic != self.MAGIC or stored != key.encode():
+                raise ValueError("Record is for another key")
+            if flags & self.ZLIB:
+                data = zlib.decompress(data)
+            im = Image.frombuffer(mode, (width, height), data, "raw", mode, 0, 1)
+        except (ValueError, zlib.error):
+            with self._lock:
+                if self._meta.get(key) is meta:
+                    del self._meta[key]
+            diagnostics.count("diskcache.miss")
+            return None
+        diagnostics.count("diskcache.hit")
+        return im
+
+    def _getlegacy(self, key):
+        """Move the PNG file of an older version for 'key' into the pack, and return its image."""
+
+        path = self._legacypath(key)
+        try:
+            im = Image.open(path)
+            im.load()
+        except OSError:
+            with self._lock:
+                self._meta.pop(key, None)
+            diagnostics.count("diskcache.miss")
+            return None
+        self.put(key, im)
+        diagnostics.count("diskcache.hit")
+        return im
+
+    def put(self, key, im):
+        """Store a PIL image under 'key', evicting the least recently used images if needed."""
+
+        # Palettes aren't stored, so such images are kept as the colours they show.
+        if im.mode not in ("L", "RGB", "RGBA"):
+            im = im.convert("RGBA" if "transparency" in im.info or "A" in im.mode else "RGB")
+        data = im.tobytes()
+        flags = 0
+        if self.compress:
+            data = zlib.compress(data, 1)
+            flags |= self.ZLIB
+        encoded = key.encode()
+        header = self.RECORD.pack(
+            self.MAGIC, flags, im.mode.encode(), im.width, im.height, len(encoded), len(data)
+        )
+        record = b"".join((header, encoded, data))
+        with self._lock, self._filelock:
+            self._sync()
+            offset = self._end
+            self._file.seek(offset)
+            self._file.write(record)
+            self._end += len(record)
+            old = self._meta.get(key)
+            self._meta[key] = [offset, len(record), time.time(), 0]
+            self._dirty = True
+            self._evict(keep=key)
+            self._maybecompact()
+        if old is not None and old[0] is None:
+            try:
+                self._legacypath(key).unlink()
+            except OSError:
+                pass
+
+    def _evict(self, keep=None):
+        total = self.nbytes
+        if total <= self.max_bytes:
+            return
+        for key in sorted(self._meta, key=lambda k: self._meta[k][2]):
+            if total <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            if self._meta[key][0] is None:
+                try:
+                    self._legacypath(key).unlink()
+                except FileNotFoundError:
+                    pass
+                except OSError:
+                    continue
+            total -= self._meta.pop(key)[1]
+            self._dirty = True
+
+    def _maybecompact(self):
+        used = sum(meta[1] for meta in self._meta.values() if meta[0] is not None)
+        if self._end - used > self._end * self.COMPACT_RATIO and time.monotonic() >= self._next_compact:
+            self._compact()
+
+    def _compact(self):
+        """Rewrite the pack with only the records in the index. Called with both locks held."""
+
+        path = self.folder.joinpath(self.PACK)
+        tmp_path = path.with_name(self.PACK + ".tmp")
+        packed = [(key, meta) for key, meta in self._meta.items() if meta[0] is not None]
+        offsets = {}
+        end = 0
+        with open(tmp_path, "wb") as file:
+            for key, meta in sorted(packed, key=lambda item: item[1][0]):
+                self._file.seek(meta[0])
+                file.write(self._file.read(meta[1]))
+                offsets[key] = end
+                end += meta[1]
+        # Windows can't replace a file that is open or mapped. Images still using the old map, or other processes,
+        # keep it open, in which case compacting is tried again after COMPACT_RETRY seconds.
+        self._map = None
+        self._file.close()
+        try:
+            os.replace(tmp_path, path)
+        except OSError:
+            os.remove(tmp_path)
+            self._next_compact = time.monotonic() + self.COMPACT_RETRY
+        else:
+            for key, meta in packed:
+                meta[0] = offsets[key]
+            self._end = end
+            self._dirty = True
+        self._file = self._openpack()
+
+    def flush(self):
+        """Write the index file if it has changed."""
+
+        with self._lock, self._filelock:
+            if not self._dirty:
+                return
+            self._sync()
+            data = json.dumps({"end": self._end, "entries": self._meta})
+            self._dirty = False
+            path = self.folder.joinpath(self.INDEX)
+            tmp_path = path.with_name(self.INDEX + ".tmp")
+            with open(tmp_path, "w") as file:
+                file.write(data)
+            os.replace(tmp_path, path)
+        legacy_path = self.folder.joinpath(self.LEGACY_METADATA)
+        if legacy_path.exists():
+            legacy_path.unlink()
+
+    def close(self):
+        """Write the index file if it has changed, and close the pack."""
+
+        self.flush()
+        with self._lock:
+            self._map = None
+            self._file.close()
@@ -0,0 +1,165 @@
+"""List, search and activate maps from the command line, without opening the RLMapLoader window.
+
+Directories default to the ones saved in RLMapLoader's settings. Only light modules are imported, so a scripted map
+swap finishes quickly. If the window is open and no directories are given, 'activate' is handed to the window, which
+already has the maps loaded.
+"""
+
+import argparse
+import sys
+import time
+
+import activate
+import config
+import instance
+from search import SearchIndex
+from wkindex import WorkshopIndex
+
+
+def loadmaps(index, workshop_dirs, rescan=True):
+    """Return the indexed maps in the list 'workshop_dirs' and a dict of their titles by workshop ID.
+
+    Directories are rescanned in parallel. Those that can't be read are left out.
+    """
+
+    if rescan:
+        workshop_dirs = list(index.rescanall(workshop_dirs))
+    titles = {_id: item.title for _id, item in index.getitems().items() if item.title}
+    return index.getmaps(workshop_dirs), titles
+
+
+def searchmaps(entries, titles, text, fuzzy=True):
+    """Return the entries matching 'text' by file name or title, best matches first.
+
+    Entries that only match approximately are left out unless 'fuzzy' is True.
+    """
+
+    search_index = SearchIndex([f"{e.name}\n{titles.get(e.path.parent.name, '')}" for e in entries])
+    return [entries[i] for i in search_index.search(text, fuzzy)]
+
+
+def findmap(entries, titles, text, search=None):
+    """Return the one entry that 'text' refers to.
+
+    'text' can be a map's path, file name with or without its extension, workshop ID or title. Otherwise, it must be
+    part of the name or title of a single map, found by 'search(text, fuzzy=False)' if given, which returns the
+    matching entries, or by searchmaps otherwise. Raises LookupError if there is no such map, or more than one.
+    """
+
+    folded = text.lower()
+    matches = [
+        e for e in entries
+        if folded in (str(e.path).lower(), e.name.lower(), e.path.stem.lower(), e.path.parent.name.lower())
+        or folded == titles.get(e.path.parent.name, "").lower()
+    ]
+    if not matches:
+        # Approximate matches would make names like 'dribble_1' ambiguous whenever 'dribble_2' exists.
+        if search is not None:
+            matches = search(text, fuzzy=False)
+        else:
+            matches = searchmaps(entries, titles, text, fuzzy=False)
+    if not matches:
+        raise LookupError(f"No map matches '{text}'")
+    if len(matches) > 1:
+        names = "\n".join(f"  {e.path}" for e in matches[:10])
+        raise LookupError(f"'{text}' matches {len(matches)} maps:\n{names}")
+    return matches[0]
+
+
+def printmaps(entries, titles):
+    for entry in entries:
+        print(f"{entry.name}\t{titles.get(entry.path.parent.name, '')}\t{entry.path}")
+
+
+def printstatus(sync, staging_bytes):
+    """Print the active map and its state, copying it again first if 'sync' is True and it's stale."""
+
+    if sync:
+        state, manifest = activate.syncactive(config.MANIFEST_PATH, staging_bytes)
+    else:
+        state, manifest = activate.checkactive(config.MANIFEST_PATH)
+    if state is None:
+        print("No map active")
+        return 0
+    if state == activate.STALE and sync:
+        state = "updated"
+    print(f"{state}\t{manifest['source']}")
+    return 1 if state == activate.STALE else 0
+
+
+def main(argv=None):
+    settings = config.loadsettings()
+    usercfg = settings["user"]
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--workshop-dir", dest="workshop_dirs", action="append", help="workshop directory to use, can be repeated"
+    )
+    parser.add_argument("--mods-dir")
+    parser.add_argument("--no-scan", action="store_true", help="use the index without checking for changes")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("list", help="list all maps as tab separated file name, title and path")
+    search = commands.add_parser("search", help="list maps matching a file name or title, best matches first")
+    search.add_argument("text")
+    activate_parser = commands.add_parser("activate", help="replace Underpass with a map")
+    activate_parser.add_argument("map", help="path, file name, workshop ID or title of the map, or a unique search")
+    group = activate_parser.add_mutually_exclusive_group()
+    group.add_argument("--symlink", dest="symlink", action="store_true", default=None)
+    group.add_argument("--copy", dest="symlink", action="store_false")
+    commands.add_parser("restore", help="restore Underpass")
+    status = commands.add_parser("status", help="show the active map and whether its source has changed since")
+    status.add_argument("--sync", action="store_true", help="copy the map again if its source has changed")
+    args = parser.parse_args(argv)
+    if args.command == "activate" and not args.workshop_dirs and not args.mods_dir:
+        answer = instance.send("activate", map=args.map, symlink=args.symlink)
+        if answer is not None:
+            print(answer.get("message", ""), file=sys.stdout if answer.get("ok") else sys.stderr)
+            return 0 if answer.get("ok") else 1
+    if not args.workshop_dirs:
+        args.workshop_dirs = config.workshopdirs(usercfg)
+    if not args.mods_dir:
+        args.mods_dir = config.modsdir(usercfg)
+    if args.command == "activate" and args.symlink is None:
+        args.symlink = bool(usercfg.getint("UseSymlinks"))
+
+    config.makefolders()
+    try:
+        if args.command == "restore":
+            if activate.restore(args.mods_dir, config.MANIFEST_PATH):
+                print("Successfully restored Underpass")
+            else:
+                print("Already restored Underpass")
+            return 0
+        if args.command == "status":
+            return printstatus(args.sync, usercfg.getint("StagingMB") * 1024 ** 2)
+
+        index = WorkshopIndex(config.INDEX_PATH)
+        try:
+            entries, titles = loadmaps(index, args.workshop_dirs, rescan=not args.no_scan)
+            if args.command == "list":
+                printmaps(entries, titles)
+            elif args.command == "search":
+                printmaps(searchmaps(entries, titles, args.text), titles)
+            elif args.command == "activate":
+                entry = findmap(entries, titles, args.map)
+                staging = None
+                staging_mb = usercfg.getint("StagingMB")
+                if staging_mb and not args.symlink:
+                    staging = activate.openstaging(activate.checkmodsdir(args.mods_dir), staging_mb * 1024 ** 2)
+                if activate.activatemap(
+                    entry.path, args.mods_dir, config.MANIFEST_PATH, symlink=args.symlink, staging=staging
+                ):
+                    index.putactivation(entry.path, time.time())
+                    print(f"Activated {entry.path}")
+                else:
+                    print(f"Already active: {entry.path}")
+        finally:
+            index.close()
+    except (activate.ActivationError, LookupError, OSError) as e:
+        print(e, file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
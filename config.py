@@ -0,0 +1,87 @@
+from configparser import ConfigParser
+import os
+from pathlib import Path
+
+
+# Appdata Folders
+APPDATA_FOLDER = Path(os.getenv("appdata") or os.path.expanduser("~/.config"), "RLMapLoader")
+CACHE_FOLDER = APPDATA_FOLDER.joinpath("imgcache")
+
+SETTINGS_PATH = APPDATA_FOLDER.joinpath("settings.ini")
+INDEX_PATH = APPDATA_FOLDER.joinpath("wkindex.db")
+MANIFEST_PATH = APPDATA_FOLDER.joinpath("activation.json")
+STARTUP_LOG_PATH = APPDATA_FOLDER.joinpath("startup.jsonl")
+DIAGNOSTICS_LOG_PATH = APPDATA_FOLDER.joinpath("diagnostics.jsonl")
+PROFILE_PATH = APPDATA_FOLDER.joinpath("profile.prof")
+# Port and token of the running window, for later launches and the command line to send it commands.
+INSTANCE_PATH = APPDATA_FOLDER.joinpath("instance.json")
+# Held by the process running the window for as long as it runs, so only one window opens.
+INSTANCE_LOCK_PATH = APPDATA_FOLDER.joinpath("instance.lock")
+
+DEFAULT_SETTINGS = {
+    "workshopdir": "C:/Program Files (x86)/Steam/steamapps/workshop/content/252950",
+    # More workshop directories, such as Steam libraries on other drives, one per line.
+    "extraworkshopdirs": "",
+    "modsdir": "C:/Program Files (x86)/Steam/steamapps/common/rocketleague/TAGame/CookedPCConsole/mods",
+    "egmodsdir": "C:/Program Files/Epic Games/rocketleague/TAGame/CookedPCConsole/mods",
+    "egmode": 0,
+    "usesymlinks": 0,
+    "showtitles": 1,
+    "hideduplicates": 0,
+    # Number of decoded previews, and megabytes of them, kept in memory.
+    "previewcacheentries": 64,
+    "previewcachemb": 32,
+    # Megabytes of preview images kept in the image cache folder.
+    "diskcachemb": 200,
+    # Megabytes of map copies kept ready to activate in the mods folder, or 0 to copy maps straight over Underpass.
+    "stagingmb": 1024,
+    # Kilobytes per second that previews of maps near the selection are downloaded at ahead of time, or 0 for no limit.
+    "prefetchkbps": 256,
+}
+
+
+def makefolders():
+    """Create the appdata folders if they don't exist."""
+
+    APPDATA_FOLDER.mkdir(parents=True, exist_ok=True)
+    CACHE_FOLDER.mkdir(exist_ok=True)
+
+
+def loadsettings():
+    """Return a ConfigParser holding the saved settings, or the defaults if none have been saved."""
+
+    settings = ConfigParser()
+    if SETTINGS_PATH.exists():
+        settings.read(SETTINGS_PATH)
+    else:
+        settings["DEFAULT"] = DEFAULT_SETTINGS
+        settings["user"] = {}
+    # Add defaults for settings that didn't exist when the file was written.
+    for key, value in DEFAULT_SETTINGS.items():
+        settings["DEFAULT"].setdefault(key, str(value))
+    return settings
+
+
+def savesettings(settings):
+    with open(SETTINGS_PATH, "w") as config_file:
+        settings.write(config_file)
+
+
+def modsdir(usercfg):
+    """Return the mods directory in use, which depends on whether Epic Games mode is on."""
+
+    if usercfg.getint("EGMode"):
+        return usercfg["EGModsDir"]
+    return usercfg["ModsDir"]
+
+
+def extraworkshopdirs(usercfg):
+    """Return the list of workshop directories configured in addition to the main one."""
+
+    return [line.strip() for line in usercfg["ExtraWorkshopDirs"].splitlines() if line.strip()]
+
+
+def workshopdirs(usercfg):
+    """Return the main workshop directory followed by the extra ones, without duplicates."""
+
+    return list(dict.fromkeys([usercfg["WorkshopDir"]] + extraworkshopdirs(usercfg)))
@@ -0,0 +1,202 @@
+"""Timing and counters for the operations that make the app feel slow.
+
+Hot paths wrap their work in 'timer(name)', count events such as cache hits with 'count(name)', and report failures
+with 'error(name, exception)'. Each timing is kept in a latency histogram, and, once 'openlog' has been called, written
+as a JSON line to a rotating log along with failures and a snapshot of all counters and histograms every
+SNAPSHOT_INTERVAL seconds. Only the standard library is used, so any module can import this without slowing down
+startup.
+"""
+
+from contextlib import contextmanager
+import cProfile
+from functools import wraps
+import json
+import logging
+from logging.handlers import RotatingFileHandler
+import os
+import threading
+import time
+
+
+# Upper edges of the latency histogram buckets, in milliseconds. Slower timings go in a last, open ended bucket.
+BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+# Seconds between snapshots written to the log.
+SNAPSHOT_INTERVAL = 60
+# Environment variable that turns on profiling for a session when set to anything but an empty string.
+PROFILE_ENV = "RLMAPLOADER_PROFILE"
+
+
+class Histogram:
+    """Counts of timings in the buckets of BUCKETS_MS, with their total and maximum."""
+
+    __slots__ = ("count", "total", "max", "buckets")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.buckets = [0] * (len(BUCKETS_MS) + 1)
+
+    def add(self, ms):
+        self.count += 1
+        self.total += ms
+        self.max = max(self.max, ms)
+        for i, edge in enumerate(BUCKETS_MS):
+            if ms <= edge:
+                self.buckets[i] += 1
+                return
+        self.buckets[-1] += 1
+
+    def percentile(self, p):
+        """Return the upper edge of the bucket holding the 'p'th percentile, or the maximum for the last bucket."""
+
+        needed = self.count * p / 100
+        seen = 0
+        for i, n in enumerate(self.buckets):
+            seen += n
+            if n and seen >= needed:
+                return BUCKETS_MS[i] if i < len(BUCKETS_MS) else self.max
+        return self.max
+
+    def summary(self):
+        return {
+            "count": self.count,
+            "mean_ms": round(self.total / self.count, 3) if self.count else 0,
+            "p50_ms": self.percentile(50),
+            "p95_ms": self.percentile(95),
+            "max_ms": round(self.max, 3),
+            "buckets": self.buckets,
+        }
+
+
+class Recorder:
+    """Collects counters and latency histograms from any thread, and writes them to a rotating JSON lines log."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+        self._logger = None
+        self._last_snapshot = time.monotonic()
+
+    def openlog(self, path, max_bytes=1024 ** 2, backups=3):
+        """Start writing timings and snapshots to the file at 'path', keeping 'backups' older files."""
+
+        handler = RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backups, encoding="utf-8")
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        logger = logging.getLogger("rlmaploader.diagnostics")
+        logger.propagate = False
+        logger.setLevel(logging.INFO)
+        logger.addHandler(handler)
+        self._logger = logger
+
+    def closelog(self):
+        if self._logger is None:
+            return
+        self.logsnapshot()
+        for handler in list(self._logger.handlers):
+            self._logger.removeHandler(handler)
+            handler.close()
+        self._logger = None
+
+    def count(self, name, n=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def record(self, name, seconds, **fields):
+        """Add a timing of 'seconds' to the histogram 'name', and log it with any extra 'fields'."""
+
+        ms = seconds * 1000
+        with self._lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram()
+            histogram.add(ms)
+        if self._logger is not None:
+            self._write({"time": round(time.time(), 3), "event": name, "ms": round(ms, 3), **fields})
+            if time.monotonic() - self._last_snapshot > SNAPSHOT_INTERVAL:
+                self.logsnapshot()
+
+    def error(self, name, error):
+        """Count a failure of the operation 'name', and log the exception 'error' that it raised."""
+
+        self.count(f"{name}.error")
+        if self._logger is not None:
+            self._write({"time": round(time.time(), 3), "event": name, "error": repr(error)})
+
+    @contextmanager
+    def timer(self, name, **fields):
+        """Time the body of a with statement, recording it under 'name' even if it raises."""
+
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start, **fields)
+
+    def timed(self, name):
+        """Decorator that times every call of a function under 'name'."""
+
+        def decorator(func):
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.timer(name):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def snapshot(self):
+        """Return the counters and a summary of each histogram, as a dict that can be dumped as JSON."""
+
+        with self._lock:
+            return {
+                "counters": dict(sorted(self.counters.items())),
+                "timings": {name: h.summary() for name, h in sorted(self.histograms.items())},
+            }
+
+    def logsnapshot(self):
+        self._last_snapshot = time.monotonic()
+        if self._logger is not None:
+            self._write({"time": round(time.time(), 3), "event": "snapshot", **self.snapshot()})
+
+    def reset(self):
+        with self._lock:
+            self.counters.clear()
+            self.histograms.clear()
+
+    def _write(self, record):
+        self._logger.info(json.dumps(record))
+
+
+# Recorder shared by the whole app.
+recorder = Recorder()
+openlog = recorder.openlog
+closelog = recorder.closelog
+count = recorder.count
+record = recorder.record
+error = recorder.error
+timer = recorder.timer
+timed = recorder.timed
+snapshot = recorder.snapshot
+
+
+def startprofile():
+    """Start profiling with cProfile if PROFILE_ENV is set, returning the profiler, or None if it isn't set.
+
+    Only the calling thread is profiled, which for the app is the Tk thread.
+    """
+
+    if not os.getenv(PROFILE_ENV):
+        return None
+    profiler = cProfile.Profile()
+    profiler.enable()
+    return profiler
+
+
+def stopprofile(profiler, path):
+    """Stop 'profiler', if there is one, and save its statistics to 'path' for viewing with pstats."""
+
+    if profiler is None:
+        return
+    profiler.disable()
+    profiler.dump_stats(str(path))
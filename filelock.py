@@ -0,0 +1,60 @@
+"""Exclusive locks on files, for folders that several RLMapLoader processes write to at once.
+
+The window and the command line tools can run at the same time, and share the image cache and the staging folder.
+"""
+
+import os
+
+if os.name == "nt":
+    import msvcrt
+else:
+    import fcntl
+
+
+class FileLock:
+    """Exclusive lock on the file at 'path', held by one process at a time while used as a context manager.
+
+    Blocks until the lock is free. On Windows, gives up with an OSError after about ten seconds. The lock isn't
+    reentrant, and only coordinates processes, so threads sharing an instance need their own lock around it.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+
+    def acquire(self, blocking=True):
+        """Take the lock, waiting for it if 'blocking' is True. Returns False if it's held elsewhere and not waiting."""
+
+        file = open(self.path, "a+b")
+        try:
+            if os.name == "nt":
+                file.seek(0)
+                msvcrt.locking(file.fileno(), msvcrt.LK_LOCK if blocking else msvcrt.LK_NBLCK, 1)
+            else:
+                fcntl.flock(file.fileno(), fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError as e:
+            file.close()
+            # Windows fails with a permission error when the region is locked by another process.
+            if not blocking and (isinstance(e, BlockingIOError) or os.name == "nt"):
+                return False
+            raise
+        self._file = file
+        return True
+
+    def release(self):
+        file, self._file = self._file, None
+        try:
+            if os.name == "nt":
+                file.seek(0)
+                msvcrt.locking(file.fileno(), msvcrt.LK_UNLCK, 1)
+            else:
+                fcntl.flock(file.fileno(), fcntl.LOCK_UN)
+        finally:
+            file.close()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
@@ -0,0 +1,62 @@
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import hashlib
+import mmap
+import os
+
+
+# Bytes hashed per update, so large maps aren't mapped into memory all at once.
+CHUNK_SIZE = 16 * 1024 ** 2
+
+
+def hash_file(path):
+    """Return a hex digest of the contents of the file at 'path'.
+
+    Reads the file through a memory map in chunks.
+    """
+
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as file:
+        size = os.fstat(file.fileno()).st_size
+        if not size:
+            return digest.hexdigest()
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            view = memoryview(mm)
+            try:
+                for start in range(0, size, CHUNK_SIZE):
+                    digest.update(view[start:start + CHUNK_SIZE])
+            finally:
+                view.release()
+    return digest.hexdigest()
+
+
+def _hash(path):
+    try:
+        return hash_file(path)
+    except OSError:
+        return None
+
+
+def hash_files(paths, workers=None, progress=None, cancel=None):
+    """Hash many files in parallel across a pool of processes.
+
+    Returns a dict mapping each path to its digest, or None if it couldn't be read. 'progress(done, total)' is
+    called as files finish. If the threading.Event 'cancel' is set, files that haven't started are skipped and left
+    out of the result.
+    """
+
+    paths = list(paths)
+    results = {}
+    if not paths:
+        return results
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(_hash, path): path for path in paths}
+        for done, future in enumerate(as_completed(futures), 1):
+            if future.cancelled():
+                continue
+            results[futures[future]] = future.result()
+            if progress is not None:
+                progress(done, len(paths))
+            if cancel is not None and cancel.is_set():
+                for f in futures:
+                    f.cancel()
+    return results
@@ -0,0 +1,164 @@
+"""Keep one RLMapLoader window running, and let later launches and the command line hand their commands to it.
+
+The running window listens on a localhost TCP port, which it records with a random token in INSTANCE_PATH. Each
+request is one line of JSON holding the token, a command and its arguments, answered by one line of JSON. Requests
+without the right token are dropped, so only processes that can read the user's appdata folder can send commands.
+Only the standard library is used, so forwarding a command costs little more than starting Python. The process
+running the window holds a lock on INSTANCE_LOCK_PATH from before the window is built, so launches made at the same
+time can't both open one.
+"""
+
+import json
+import os
+import secrets
+import socket
+import threading
+import time
+import traceback
+
+from config import INSTANCE_LOCK_PATH, INSTANCE_PATH
+from filelock import FileLock
+
+
+# Seconds to wait for the running window to accept a connection. It's on the same machine, so this is generous.
+CONNECT_TIMEOUT = 0.5
+# Seconds to wait for an answer. Activating a map can take a while when it has to be copied.
+REPLY_TIMEOUT = 300
+# Longest request accepted, in bytes.
+MAX_REQUEST = 64 * 1024
+# Seconds to keep trying to show the window of the process holding the instance lock, which may still be starting.
+CLAIM_TIMEOUT = 30
+# Seconds between tries.
+CLAIM_RETRY = 0.2
+
+
+def send(command, timeout=REPLY_TIMEOUT, **args):
+    """Send 'command' with the keyword arguments 'args' to the running window, and return its answer as a dict.
+
+    Answers hold "ok", which is False if the command failed, and a "message" to show. Returns None if no window is
+    running.
+    """
+
+    try:
+        with open(INSTANCE_PATH) as file:
+            info = json.load(file)
+        port, token = info["port"], info["token"]
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+    request = json.dumps({"token": token, "command": command, "args": args}).encode() + b"\n"
+    try:
+        with socket.create_connection(("127.0.0.1", port), timeout=CONNECT_TIMEOUT) as sock:
+            sock.settimeout(timeout)
+            sock.sendall(request)
+            with sock.makefile("rb") as file:
+                line = file.readline()
+    except OSError:
+        return None
+    try:
+        return json.loads(line)
+    except ValueError:
+        return None
+
+
+def claim(path=INSTANCE_LOCK_PATH, timeout=CLAIM_TIMEOUT):
+    """Decide whether this process opens the window, or shows the one another process has open.
+
+    Returns the held FileLock on 'path' if this process should open the window. The lock must be released once the
+    window closes. Otherwise shows the other window and returns None. A window that is still starting can't answer
+    yet, so it's asked again until 'timeout' seconds have passed, after which None is returned anyway.
+    """
+
+    lock = FileLock(path)
+    deadline = time.monotonic() + timeout
+    while True:
+        if lock.acquire(blocking=False):
+            return lock
+        if send("show", timeout=5) is not None or time.monotonic() > deadline:
+            return None
+        time.sleep(CLAIM_RETRY)
+
+
+class Server:
+    """Accept commands for the running window on a background thread.
+
+    'handler(command, args, reply)' is called on the server's thread for each request with the right token. It must
+    call 'reply(answer)' once, from any thread, with a dict that can be dumped as JSON. Each connection is served on
+    its own thread, so a slow command doesn't hold up the others.
+    """
+
+    def __init__(self, handler, path=INSTANCE_PATH):
+        self.handler = handler
+        self.path = path
+        self.token = secrets.token_hex(16)
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._sock.bind(("127.0.0.1", 0))
+        self._sock.listen(8)
+        self.port = self._sock.getsockname()[1]
+        self._thread = None
+        self._stopped = False
+
+    def start(self):
+        """Start accepting commands, and record the port and token for other processes to find."""
+
+        tmp_path = self.path.with_suffix(".tmp")
+        with open(tmp_path, "w") as file:
+            json.dump({"port": self.port, "token": self.token, "pid": os.getpid()}, file)
+        os.replace(tmp_path, self.path)
+        self._thread = threading.Thread(target=self._serve, name="instance", daemon=True)
+        self._thread.start()
+        return self
+
+    def close(self):
+        """Stop accepting commands, and forget the recorded port unless another window has taken over since."""
+
+        self._stopped = True
+        # Wakes up the accepting thread on Linux, where closing the socket alone doesn't.
+        try:
+            self._sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self._sock.close()
+        try:
+            with open(self.path) as file:
+                if json.load(file).get("token") == self.token:
+                    os.remove(self.path)
+        except (OSError, ValueError, AttributeError):
+            pass
+
+    def _serve(self):
+        while not self._stopped:
+            try:
+                conn, address = self._sock.accept()
+            except OSError:
+                return
+            threading.Thread(target=self._answer, args=(conn,), name="instance-request", daemon=True).start()
+
+    def _answer(self, conn):
+        with conn:
+            try:
+                conn.settimeout(CONNECT_TIMEOUT)
+                with conn.makefile("rb") as file:
+                    request = json.loads(file.readline(MAX_REQUEST))
+                if not secrets.compare_digest(str(request.get("token")), self.token):
+                    return
+                command, args = request["command"], request.get("args") or {}
+            except (OSError, ValueError, KeyError, AttributeError):
+                return
+            done = threading.Event()
+            answer = {}
+
+            def reply(result):
+                answer.update(result)
+                done.set()
+
+            try:
+                self.handler(command, args, reply)
+            except Exception:
+                traceback.print_exc()
+                reply({"ok": False, "message": "Command failed"})
+            if not done.wait(REPLY_TIMEOUT):
+                answer = {"ok": False, "message": "Timed out"}
+            try:
+                conn.sendall(json.dumps(answer).encode() + b"\n")
+            except OSError:
+                pass
@@ -1,11 +1,13 @@
-from collections import OrderedDict
-from configparser import ConfigParser
+# Imported first, so startup times include the time spent importing everything else.
+from timing import StartupTimer
+
+from collections import Counter, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from functools import partial
-from itertools import chain
-import os
 from pathlib import Path
-import re
-from shutil import copyfile
+import queue
+import threading
+import time
 import tkinter as tk
 from tkinter import ttk, filedialog
 import tkinter.messagebox as msg
@@ -13,7 +15,22 @@ import webbrowser
 
 from PIL import Image, ImageTk, ImageDraw, ImageFont
 
-from scraper import WorkshopItem, ItemNotFoundError
+import activate
+from cache import DiskCache, PhotoCache
+import config
+import diagnostics
+from cli import findmap
+from config import CACHE_FOLDER, INDEX_PATH, MANIFEST_PATH, STARTUP_LOG_PATH
+from hashing import hash_files
+import instance
+from maplist import MapList
+from prefetch import Prefetcher, RateLimiter, Throttle
+from preview import PreviewLoader
+from search import SearchIndex
+from thumbs import build_thumbnails, load_thumbnail, loadpreview
+import upk
+from watcher import Watcher
+from wkindex import WorkshopIndex
 
 
 def warnwrap(f):
@@ -49,13 +66,60 @@ def multi(*funcs):
 
 
 HELP_URL = "https://github.com/mishnea/RLMapLoader#usage"
+# Milliseconds to wait after the last keystroke before filtering the map list.
+SEARCH_DELAY = 150
+# Milliseconds to wait after the last change to the workshop dir before scanning it.
+SCAN_DELAY = 500
+# Number of maps on each side of the selection whose previews are loaded ahead of time.
+PREFETCH_NEIGHBOURS = 4
+# Shown when a map can't be activated because another activation or update of the active map is running.
+BUSY_MESSAGE = "Another map is being activated, or the active map updated. Try again in a moment."
+
 
-# Appdata Folders
-APPDATA_FOLDER = Path(os.getenv("appdata"), "RLMapLoader")
-APPDATA_FOLDER.mkdir(exist_ok=True)
+class ProgressDialog(tk.Toplevel):
+    """Modal window showing the progress of a background task, with a button to cancel it.
 
-CACHE_FOLDER = APPDATA_FOLDER.joinpath("imgcache")
-CACHE_FOLDER.mkdir(exist_ok=True)
+    The task reports its progress from its own thread through 'setprogress', and checks 'cancelled' to stop early.
+    """
+
+    def __init__(self, parent, title, text, poll=50):
+        super().__init__(parent)
+        self.title(title)
+        self.resizable(False, False)
+        self.transient(parent)
+        self.protocol("WM_DELETE_WINDOW", self.cancel)
+        self.poll = poll
+        self.cancelled = threading.Event()
+        self.done = 0
+        self.total = 0
+
+        frame = ttk.Frame(self, padding=8)
+        frame.pack()
+        ttk.Label(frame, text=text).grid(row=0, sticky="w")
+        self.bar = ttk.Progressbar(frame, length=240, maximum=1.0)
+        self.bar.grid(row=1, pady=4)
+        self.button = ttk.Button(frame, text="Cancel", command=self.cancel)
+        self.button.grid(row=2, sticky="e")
+
+        self.grab_set()
+        self._after = self.after(self.poll, self.update_bar)
+
+    def setprogress(self, done, total):
+        self.done = done
+        self.total = total
+
+    def cancel(self):
+        self.cancelled.set()
+        self.button.config(state=tk.DISABLED)
+
+    def update_bar(self):
+        if self.total:
+            self.bar["value"] = self.done / self.total
+        self._after = self.after(self.poll, self.update_bar)
+
+    def destroy(self):
+        self.after_cancel(self._after)
+        super().destroy()
 
 
 class MainApp(tk.Tk):
@@ -63,6 +127,7 @@ class MainApp(tk.Tk):
 
     def __init__(self):
         super().__init__()
+        self.timer = StartupTimer()
 
         self.title("RLMapLoader")
         self.iconbitmap("icon.ico")
@@ -72,24 +137,213 @@ class MainApp(tk.Tk):
         self.loadcfg()
         self.search = tk.StringVar(value="")
         self.use_symlinks = tk.IntVar(value=self.usercfg.getint("UseSymlinks"))
+        self.show_titles = tk.IntVar(value=self.usercfg.getint("ShowTitles"))
+        self.hide_duplicates = tk.IntVar(value=self.usercfg.getint("HideDuplicates"))
         self.eg_mode = tk.IntVar(value=self.usercfg.getint("EGMode"))
         self.workshop_dir = tk.StringVar(value=self.usercfg["WorkshopDir"])
+        self.extra_wkdirs = config.extraworkshopdirs(self.usercfg)
         if self.eg_mode.get():
             self.mods_dir = tk.StringVar(value=self.usercfg["EGModsDir"])
         else:
             self.mods_dir = tk.StringVar(value=self.usercfg["ModsDir"])
-        self.wkfiles = self.getwkfiles()
+        self.wkindex = WorkshopIndex(INDEX_PATH)
+        # The list is filled from the index once the window is showing, then refreshed from disk in the background.
+        self.allwkfiles = OrderedDict()
+        self.titles = {}
+        self.hashes = {}
+        # Package headers of maps by path, read in the background.
+        self.headers = {}
+        self.dupnames = set()
+        self.activations = {}
+        self.search_index = SearchIndex([])
+        self.wkfiles = self.allwkfiles
+        # Entries matching the search, best matches first. The map list shows them in this order unless it's sorted.
+        self.wkitems = list(self.wkfiles.values())
+        self._filter_after = None
+        self._scan_after = None
+        self._selected = ()
+        self._preview_start = 0.0
+        # True while a map is being activated, or the active map checked or copied again, in the background. Only one
+        # of these runs at a time, since they all replace Underpass and write the manifest.
+        self._busy = False
+        # True while changes from the watcher are being applied in the background.
+        self._applying = False
         # Size for preview image.
         self.img_size = (240, 158)
         # Get a default image to be used for preview.
         self.img_default = self.getdefaultimg("default.png", alt_text="No preview")
+        # Placeholder shown while a preview is loading in the background.
+        self.img_loading = self.getdefaultimg("loading.png", alt_text="Loading...")
+        self.preview_loader = PreviewLoader(self)
+        # Watches the workshop directories once the list has been loaded. Batches of changes come back through a queue.
+        self.watcher = None
+        self.watch_queue = queue.Queue()
+        # Commands from later launches and the command line, handed over from the server's threads.
+        self.remote_queue = queue.Queue()
+        # Runs longer tasks started from the UI.
+        self.executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="task")
+        self.photo_cache = PhotoCache(
+            max_entries=self.usercfg.getint("PreviewCacheEntries"),
+            max_bytes=self.usercfg.getint("PreviewCacheMB") * 1024 ** 2,
+        )
+        self.disk_cache = DiskCache(CACHE_FOLDER, max_bytes=self.usercfg.getint("DiskCacheMB") * 1024 ** 2)
+        # Loads the previews of maps near the selection before they're selected, so browsing doesn't wait on them.
+        rate = self.usercfg.getint("PrefetchKBps")
+        self.prefetch_limiter = RateLimiter(rate * 1024) if rate > 0 else None
+        self.prefetcher = Prefetcher(self.prefetchpreview, workers=2)
         self.modfiles = {}
         self.frames = {}
         self.widgets = {}
         self._initwidgets()
         self._initmenu()
-        # Start preview update on a timer.
-        self.updateimg()
+        self.timer.mark("init")
+        self._shown = False
+        self.bind("<Map>", self.onmap)
+        # Generated by the watcher and server threads when they queue something, so the Tk thread sleeps otherwise.
+        self.bind("<<Watched>>", lambda event: self.applywatched())
+        self.bind("<<Remote>>", lambda event: self.applyremote())
+        try:
+            self.server = instance.Server(self.onremote).start()
+        except OSError:
+            self.server = None
+
+    def onmap(self, event):
+        """Start filling the list once the window has been shown for the first time."""
+
+        if event.widget is not self or self._shown:
+            return
+        self._shown = True
+        self.timer.mark("first_frame")
+        self.after_idle(self.loadlist)
+        # Commands sent before the main loop started couldn't wake it.
+        self.after_idle(self.applyremote)
+
+    def wake(self, sequence):
+        """Generate the virtual event 'sequence' on the Tk thread after any events already waiting. Thread safe."""
+
+        try:
+            self.event_generate(sequence, when="tail")
+        except (RuntimeError, tk.TclError):
+            # The main loop isn't running yet, or has stopped.
+            pass
+
+    def loadlist(self):
+        """Fill the listbox from the workshop index, then refresh the index from disk in the background."""
+
+        roots = self.workshopdirs()
+        self.allwkfiles = OrderedDict((e.path, e) for e in self.wkindex.getmaps(roots))
+        self.buildsearch()
+        self.fillwslist()
+        self.timer.mark("interactive")
+        self.runtask(self.refreshindex, partial(self.onrefreshed, roots), roots)
+
+    def refreshindex(self, roots):
+        """Bring the index up to date for 'roots', returning the changed folder counts by root. Blocks."""
+
+        # Import the scraper now, so loading the first preview doesn't have to.
+        import scraper  # noqa: F401
+
+        return self.wkindex.rescanall(roots)
+
+    def onrefreshed(self, roots, counts, error):
+        """Refill the listbox if the background refresh found changes, and report startup times."""
+
+        if error is not None:
+            diagnostics.error("refresh", error)
+        elif (any(counts.values()) or len(counts) < len(roots)) and roots == self.workshopdirs():
+            self.allwkfiles = OrderedDict((e.path, e) for e in self.wkindex.getmaps(list(counts)))
+            self.buildsearch()
+            self.fillwslist()
+        self.timer.mark("refreshed")
+        self.timer.report(STARTUP_LOG_PATH)
+        self.startwatcher()
+        self.inspectmaps()
+        self.checkactivemap()
+
+    def startwatcher(self):
+        """Watch the workshop directories in use for changes, replacing any watcher of other directories."""
+
+        if self.watcher is not None:
+            self.watcher.stop()
+        roots = self.workshopdirs()
+        self.watcher = Watcher(roots, lambda changes: self.onwatched(roots, changes)).start()
+
+    def onwatched(self, roots, changes):
+        """Update the index with a batch of changes from the watcher, and queue them for the map list. Blocks."""
+
+        for root, folders in changes.items():
+            if folders is None:
+                try:
+                    self.wkindex.rescan(root)
+                except OSError:
+                    pass
+                self.watch_queue.put((roots, None, None))
+            else:
+                entries = self.wkindex.updatefolders(root, folders)
+                self.watch_queue.put((roots, {Path(f) for f in folders}, entries))
+        self.wake("<<Watched>>")
+
+    def applywatched(self):
+        """Apply the changes found by the watcher to the map list, in one update for everything queued.
+
+        The new list and search index are built in the background, then swapped in. Changes queued meanwhile are
+        applied once that's done.
+        """
+
+        if self._applying:
+            return
+        roots = self.workshopdirs()
+        changes = []
+        reload = False
+        while True:
+            try:
+                watched, folders, entries = self.watch_queue.get_nowait()
+            except queue.Empty:
+                break
+            # Ignore changes from a watcher of directories that are no longer in use.
+            if watched != roots:
+                continue
+            if folders is None:
+                reload = True
+                continue
+            changes.append((folders, entries))
+            for folder in folders:
+                self.prefetcher.discard(str(folder))
+                self.photo_cache.discard(str(folder))
+        if reload:
+            # Any of the previews may have changed.
+            self.photo_cache.clear()
+        elif not changes:
+            return
+        base = self.allwkfiles
+
+        def work():
+            if reload:
+                files = OrderedDict((e.path, e) for e in self.wkindex.getmaps(roots))
+            else:
+                files = base
+                for folders, entries in changes:
+                    files = OrderedDict((p, e) for p, e in files.items() if e.path.parent not in folders)
+                    files.update((e.path, e) for e in entries)
+                files = OrderedDict((e.path, e) for e in sorted(files.values(), key=lambda e: e.name.lower()))
+            return files, self.loadsearch(files, roots)
+
+        def done(result, error):
+            self._applying = False
+            if error is not None:
+                diagnostics.error("watch", error)
+            # The list may have been reloaded from the index meanwhile, with these changes in it.
+            elif roots == self.workshopdirs() and self.allwkfiles is base:
+                self.allwkfiles, search = result
+                self.setsearch(search)
+                self.fillwslist()
+                self.inspectmaps()
+                self.checkactivemap()
+            if not self.watch_queue.empty():
+                self.applywatched()
+
+        self._applying = True
+        self.runtask(work, done)
 
     @staticmethod
     def checkdir(widget, *args):
@@ -108,38 +362,34 @@ class MainApp(tk.Tk):
             widget.config(style="R.TEntry")
 
     def onclose(self):
+        if self.server is not None:
+            self.server.close()
+        if self.watcher is not None:
+            self.watcher.stop()
+        self.preview_loader.shutdown()
+        self.prefetcher.shutdown()
+        self.executor.shutdown(wait=False)
+        self.disk_cache.close()
+        self.wkindex.close()
         self.savecfg()
         self.destroy()
 
     def loadcfg(self):
-        filename = "settings.ini"
-        path = APPDATA_FOLDER.joinpath(filename)
-        self.settings = ConfigParser()
-        if path.exists():
-            self.settings.read(path)
-        else:
-            self.settings["DEFAULT"] = {
-                "workshopdir": "C:/Program Files (x86)/Steam/steamapps/workshop/content/252950",
-                "modsdir": "C:/Program Files (x86)/Steam/steamapps/common/rocketleague/TAGame/CookedPCConsole/mods",
-                "egmodsdir": "C:/Program Files/Epic Games/rocketleague/TAGame/CookedPCConsole/mods",
-                "egmode": 0,
-                "usesymlinks": 0,
-            }
-            self.settings["user"] = {}
+        self.settings = config.loadsettings()
         self.usercfg = self.settings["user"]
 
     def savecfg(self):
         self.usercfg["WorkshopDir"] = self.workshop_dir.get()
+        self.usercfg["ExtraWorkshopDirs"] = "\n".join(self.extra_wkdirs)
         if self.eg_mode.get():
             self.usercfg["EGModsDir"] = self.mods_dir.get()
         else:
             self.usercfg["ModsDir"] = self.mods_dir.get()
         self.usercfg["EGMode"] = str(self.eg_mode.get())
         self.usercfg["UseSymlinks"] = str(self.use_symlinks.get())
-        filename = "settings.ini"
-        path = APPDATA_FOLDER.joinpath(filename)
-        with open(path, "w") as config_file:
-            self.settings.write(config_file)
+        self.usercfg["ShowTitles"] = str(self.show_titles.get())
+        self.usercfg["HideDuplicates"] = str(self.hide_duplicates.get())
+        config.savesettings(self.settings)
 
     def changemode(self, *args, **kwargs):
         self.widgets["e_mdir"].delete(0, tk.END)
@@ -149,57 +399,194 @@ class MainApp(tk.Tk):
             self.widgets["e_mdir"].insert(0, self.usercfg["ModsDir"])
 
     def getselected(self):
-        """Return the name and path of the selected map.
+        """Return the index entry of the selected map.
 
-        Returns a tuple containing the current selection's items, or an empty tuple if nothing is selected
+        Returns a MapEntry for the current selection, or an empty tuple if nothing is selected
         """
 
-        if not self.widgets["lb_wkfiles"].curselection():
-            return ()
-        index = self.widgets["lb_wkfiles"].curselection()[0]
-        return list(self.wkfiles.items())[index]
+        return self.widgets["ml_wkfiles"].selected or ()
 
     def copytolabs(self):
         """Copy the selected map to the mods folder
 
         Tries to copy the selected '.udk' file to the mods folder. Shows a messagebox on success or failure.
+        The copy runs in the background with a progress window, and is skipped if the map is already active.
         """
 
-        selection = self.getselected()
-        if not selection:
-            msg.showerror("Activate", "Cannot activate: No map selected")
-            return
-        name, src = selection
-        if not Path(src).is_file():
-            msg.showerror("Activate", "Cannot activate: File not found")
+        if self._busy:
+            msg.showinfo("Activate", BUSY_MESSAGE)
             return
-        dest = Path(self.mods_dir.get())
+        selection = self.getselected()
+        src = selection and selection.path
         try:
-            is_dir = dest.is_dir()
-        except OSError:
-            is_dir = False
-        if is_dir:
-            if dest.name.lower() != "mods":
-                msg.showerror("Activate", "Invalid path: Mods path must lead to a folder called 'mods'")
+            activate.checksource(src)
+            up_path = activate.checkmodsdir(self.mods_dir.get()).joinpath(activate.UNDERPASS)
+            mode = "symlink" if self.use_symlinks.get() else "copy"
+            if activate.isactive(activate.readmanifest(MANIFEST_PATH), src, up_path, mode):
+                msg.showinfo("Activate", "Map is already active")
                 return
-            up_path = Path(dest.joinpath("Labs_Underpass_P.upk"))
-            if up_path.exists():
-                up_path.unlink()
             if self.use_symlinks.get():
-                try:
-                    up_path.symlink_to(src)
-                except OSError as e:
-                    msg.showerror("Activate", f"Couldn't create symlink. Full Python exception:\n{repr(e)}")
-                    return
+                activate.symlinkmap(src, up_path)
+                activate.writemanifest(MANIFEST_PATH, src, up_path, mode)
+                self.recordactivation(src)
+                self.checkactivemap()
                 msg.showinfo("Activate", "Symlink successfully created in mods")
                 return
-            copyfile(
-                src,
-                dest.joinpath("Labs_Underpass_P.upk")
-            )
-            msg.showinfo("Activate", "Map successfully copied to mods")
+        except activate.ActivationError as e:
+            msg.showerror("Activate", str(e))
+            return
+        self.copyinbackground(src, up_path)
+
+    def copyinbackground(self, src, up_path):
+        """Copy the map 'src' to 'up_path' on a background thread, showing a progress window that can cancel it.
+
+        Goes through the staging folder unless StagingMB is 0, so maps that are already staged activate at once.
+        """
+
+        dialog = ProgressDialog(self, "Activate", f"Copying {src.name}")
+        staging_mb = self.usercfg.getint("StagingMB")
+        self._busy = True
+
+        def work():
+            if staging_mb:
+                staging = activate.openstaging(up_path.parent, staging_mb * 1024 ** 2)
+                staging.activate(src, up_path, progress=dialog.setprogress, cancel=dialog.cancelled)
+            else:
+                activate.copymap(src, up_path, progress=dialog.setprogress, cancel=dialog.cancelled)
+
+        def done(result, error):
+            dialog.destroy()
+            self._busy = False
+            if error is None:
+                activate.writemanifest(MANIFEST_PATH, src, up_path, "copy")
+                self.recordactivation(src)
+            # Catches up with any changes to the active map that were skipped while copying.
+            self.checkactivemap()
+            if error is None:
+                msg.showinfo("Activate", "Map successfully copied to mods")
+            elif isinstance(error, activate.CopyCancelled):
+                msg.showinfo("Activate", "Activation cancelled. The previous map is still active.")
+            else:
+                msg.showerror("Activate", f"Couldn't copy map. Full Python exception:\n{repr(error)}")
+
+        self.runtask(work, done)
+
+    def recordactivation(self, path):
+        """Store the time the map at 'path' was activated, and show it in the map list."""
+
+        now = time.time()
+        self.activations[path] = now
+        self.wkindex.putactivation(path, now)
+        self.widgets["ml_wkfiles"].refresh()
+
+    def onremote(self, command, args, reply):
+        """Queue a command from another process for the Tk thread. Called on the server's threads."""
+
+        self.remote_queue.put((command, args, reply))
+        self.wake("<<Remote>>")
+
+    def applyremote(self):
+        """Carry out the commands queued by onremote."""
+
+        while True:
+            try:
+                command, args, reply = self.remote_queue.get_nowait()
+            except queue.Empty:
+                break
+            if command == "show":
+                self.deiconify()
+                self.lift()
+                self.focus_force()
+                reply({"ok": True, "message": "Shown"})
+            elif command == "activate":
+                self.remoteactivate(args, reply)
+            else:
+                reply({"ok": False, "message": f"Unknown command '{command}'"})
+
+    def remoteactivate(self, args, reply):
+        """Activate the map named by args["map"] for the command line, using the maps and search index in memory.
+
+        Copies in the background without a progress window, and passes the outcome to 'reply'.
+        """
+
+        entries = list(self.allwkfiles.values())
+
+        def search(text, fuzzy=True):
+            return [entries[i] for i in self.search_index.search(text, fuzzy)]
+
+        try:
+            if self._busy:
+                raise activate.ActivationError(BUSY_MESSAGE)
+            entry = findmap(entries, self.titles, args["map"], search)
+        except (activate.ActivationError, LookupError) as e:
+            reply({"ok": False, "message": str(e)})
             return
-        msg.showerror("Activate", "Invalid path: Mods path given is not a real directory")
+        symlink = args.get("symlink")
+        if symlink is None:
+            symlink = bool(self.use_symlinks.get())
+        mods_dir = self.mods_dir.get()
+        staging_mb = self.usercfg.getint("StagingMB")
+        self._busy = True
+
+        def work():
+            staging = None
+            if staging_mb and not symlink:
+                staging = activate.openstaging(activate.checkmodsdir(mods_dir), staging_mb * 1024 ** 2)
+            return activate.activatemap(entry.path, mods_dir, MANIFEST_PATH, symlink=symlink, staging=staging)
+
+        def done(activated, error):
+            self._busy = False
+            if activated:
+                self.recordactivation(entry.path)
+            self.checkactivemap()
+            if error is not None:
+                reply({"ok": False, "message": str(error)})
+            elif activated:
+                reply({"ok": True, "message": f"Activated {entry.path}"})
+            else:
+                reply({"ok": True, "message": f"Already active: {entry.path}"})
+
+        self.runtask(work, done, poll=10)
+
+    def checkactivemap(self):
+        """Check in the background whether the source of the active map has changed, and copy it again if it has.
+
+        Only stats both files unless their sizes or times have changed. Shows the active map once the check is done.
+        Does nothing if a check or an activation is already running. Activations check again when they finish.
+        """
+
+        if self._busy:
+            return
+        self._busy = True
+        staging_bytes = self.usercfg.getint("StagingMB") * 1024 ** 2
+
+        self.runtask(activate.syncactive, self.showactive, MANIFEST_PATH, staging_bytes)
+
+    def showactive(self, result, error):
+        """Show the active map, given the (state, manifest) found by checkactivemap, or the error it raised."""
+
+        self._busy = False
+        if error is None:
+            state, manifest = result
+        else:
+            state, manifest = activate.STALE, activate.readmanifest(MANIFEST_PATH)
+        name = manifest and Path(manifest["source"]).name
+        if state is None:
+            text = "No map active"
+        elif state == activate.REPLACED:
+            text = "Underpass was changed outside RLMapLoader"
+        elif state == activate.MISSING:
+            text = f"Active: {name} (deleted from workshop)"
+        elif state == activate.STALE and error is not None:
+            # The window has no console, so the full error goes to the diagnostics log.
+            diagnostics.error("activation.resync", error)
+            reason = str(error).splitlines()[0] if str(error) else type(error).__name__
+            text = f"Active: {name} (out of date, couldn't update: {reason})"
+        elif state == activate.STALE:
+            text = f"Active: {name} (updated)"
+        else:
+            text = f"Active: {name}"
+        self.widgets["l_active"].configure(text=text)
 
     def deleteunderpass(self):
         """Delete 'Underpass' from the mods folder.
@@ -208,52 +595,202 @@ class MainApp(tk.Tk):
         Displays a messagebox with the outcome.
         """
 
-        path = Path(self.mods_dir.get())
-        up_path = path.joinpath("Labs_Underpass_P.upk")
+        if self._busy:
+            msg.showinfo("Restore Underpass", BUSY_MESSAGE)
+            return
         try:
-            is_dir = path.is_dir()
-        except OSError:
-            is_dir = False
-        if is_dir:
-            if path.name.lower() != "mods":
-                msg.showerror("Restore Underpass", "Invalid path: Mods path must lead to a folder called 'mods'")
+            restored = activate.restore(self.mods_dir.get(), MANIFEST_PATH)
+        except activate.ActivationError as e:
+            msg.showerror("Restore Underpass", str(e))
+            return
+        self.checkactivemap()
+        if restored:
+            msg.showinfo("Restore Underpass", "Successfully restored Underpass")
+        else:
+            msg.showinfo("Restore Underpass", "Already restored Underpass")
+
+    def workshopdirs(self):
+        """Return the list of workshop directories in use, starting with the one in the entry box."""
+
+        return list(dict.fromkeys([self.workshop_dir.get()] + self.extra_wkdirs))
+
+    def queuescan(self, *args):
+        """Rescan the workshop directories once the workshop dir has stopped changing for SCAN_DELAY milliseconds."""
+
+        if self._scan_after is not None:
+            self.after_cancel(self._scan_after)
+        self._scan_after = self.after(SCAN_DELAY, self.scanwkfiles)
+
+    def scanwkfiles(self, *args):
+        """Rescan the workshop directories in the background, then refill the listbox.
+
+        Directories that are no longer in use are removed from the index.
+        """
+
+        self._scan_after = None
+        roots = self.workshopdirs()
+
+        def work():
+            counts = self.wkindex.rescanall(roots)
+            self.wkindex.forgetothers(roots)
+            return self.wkindex.getmaps(list(counts))
+
+        def done(entries, error):
+            if error is not None:
+                diagnostics.error("scan", error)
                 return
-            if up_path.exists():
-                up_path.unlink()
-                msg.showinfo("Restore Underpass", "Successfully restored Underpass")
+            # The directories changed again while scanning, and another scan has been queued.
+            if roots != self.workshopdirs():
                 return
-            msg.showinfo("Restore Underpass", "Already restored Underpass")
-            return
-        msg.showerror("Restore Underpass", "Invalid path: Mods path given is not a real directory")
+            self.allwkfiles = OrderedDict((e.path, e) for e in entries)
+            self.buildsearch()
+            self.fillwslist()
+            if self.watcher is not None:
+                self.startwatcher()
 
-    def getwkfiles(self):
-        """Return an OrderedDict containing name-path pairs of workshop files."""
+        self.runtask(work, done)
 
-        path = Path(self.workshop_dir.get())
-        try:
-            paths = sorted(chain(path.glob("*/*.udk"), path.glob("*.udk")), key=lambda p: p.name.lower())
-        except OSError:
-            return OrderedDict()
-        udks = OrderedDict((p.name, p) for p in paths)
-        return udks
+    def buildsearch(self):
+        """Load map titles and hashes from the workshop index and rebuild the search index over names and titles."""
 
-    def fillwslist(self, *args):
-        """Fill listbox with workshop file names."""
+        self.setsearch(self.loadsearch(self.allwkfiles, self.workshopdirs()))
+
+    def loadsearch(self, files, roots):
+        """Return what 'setsearch' takes for the maps 'files' in the workshop directories 'roots'.
+
+        Loads the titles, hashes, activations and package headers of the maps from the workshop index, and builds a
+        search index over their names and titles. Blocks, and can be run on a worker thread.
+        """
+
+        titles = {_id: item.title for _id, item in self.wkindex.getitems().items() if item.title}
+        names = Counter(e.name.lower() for e in files.values())
+        return (
+            titles,
+            self.wkindex.gethashes(roots),
+            self.wkindex.getactivations(),
+            self.wkindex.getheaders(roots),
+            {name for name, count in names.items() if count > 1},
+            SearchIndex([f"{e.name}\n{titles.get(e.path.parent.name, '')}" for e in files.values()]),
+        )
+
+    def setsearch(self, search):
+        """Swap in the titles, hashes, activations, headers, duplicate names and search index from 'loadsearch'."""
+
+        self.titles, self.hashes, self.activations, self.headers, self.dupnames, self.search_index = search
+
+    def displayname(self, entry):
+        """Return the text shown in the listbox for a map entry."""
+
+        title = self.titles.get(entry.path.parent.name)
+        if title and self.show_titles.get():
+            return title
+        # Tell apart maps with the same file name by their folder.
+        if entry.name.lower() in self.dupnames:
+            return f"{entry.name} ({entry.path.parent.name})"
+        return entry.name
+
+    def formatrow(self, entry):
+        """Return the text shown in each column of the map list for a map entry."""
+
+        activated = self.activations.get(entry.path)
+        return (
+            self.displayname(entry),
+            f"{entry.size / 1024 ** 2:.1f} MB",
+            time.strftime("%Y-%m-%d", time.localtime(entry.mtime / 1e9)),
+            time.strftime("%Y-%m-%d %H:%M", time.localtime(activated)) if activated else "",
+            self.packagetext(entry),
+        )
+
+    def packagetext(self, entry):
+        """Return the package version of a map entry, "Damaged" if its header isn't valid, or "" if it isn't known."""
 
-        pattern = f".*{re.escape(self.search.get())}.*"
-        self.wkfiles = {k: v for k, v in self.getwkfiles().items() if re.match(pattern, k, re.IGNORECASE)}
+        header = self.headers.get(entry.path)
+        if header is None:
+            return ""
+        if header.error:
+            return "Damaged"
+        return f"v{header.version}"
 
-        widget = self.widgets["lb_wkfiles"]
-        widget.delete(0, tk.END)
-        widget.insert(tk.END, *self.wkfiles.keys())
+    def showdetails(self):
+        """Show the package details of the selected map under the preview."""
+
+        selection = self.getselected()
+        header = self.headers.get(selection.path) if selection else None
+        if header is None:
+            text = ""
+        elif header.error:
+            text = f"Damaged: {header.error}"
+        else:
+            text = (
+                f"Package v{header.version}/{header.licensee}, {header.names:,} names, {header.exports:,} exports, "
+                f"{header.imports:,} imports"
+            )
+        self.widgets["l_details"].configure(text=text)
+
+    def inspectmaps(self):
+        """Read the package headers of maps that have changed since their headers were last read, in the background.
+
+        Only the start of each map is read. The map list and details are updated once the headers are stored.
+        """
+
+        roots = self.workshopdirs()
+
+        def work():
+            entries = self.wkindex.uninspected(roots)
+            with diagnostics.timer("inspect", maps=len(entries)):
+                headers = {e.path: upk.inspect(e.path) for e in entries}
+            self.wkindex.putheaders(entries, headers)
+            return len(entries)
+
+        def done(count, error):
+            if error is not None:
+                diagnostics.error("inspect", error)
+            elif count and roots == self.workshopdirs():
+                self.headers = self.wkindex.getheaders(roots)
+                self.widgets["ml_wkfiles"].refresh()
+                self.showdetails()
+
+        self.runtask(work, done)
+
+    def queuefilter(self, *args):
+        """Fill the listbox once the search text has stopped changing for SEARCH_DELAY milliseconds."""
+
+        if self._filter_after is not None:
+            self.after_cancel(self._filter_after)
+        self._filter_after = self.after(SEARCH_DELAY, self.fillwslist)
+
+    @diagnostics.timed("filter")
+    def fillwslist(self, *args):
+        """Fill listbox with the names of workshop files matching the search text, best matches first."""
+
+        self._filter_after = None
+        entries = list(self.allwkfiles.values())
+        self.wkfiles = OrderedDict(
+            (entries[i].path, entries[i]) for i in self.search_index.search(self.search.get())
+        )
+        if self.hide_duplicates.get():
+            # Only keep the first of the maps with the same contents.
+            seen = set()
+            for path in list(self.wkfiles):
+                digest = self.hashes.get(path)
+                if digest in seen:
+                    del self.wkfiles[path]
+                elif digest is not None:
+                    seen.add(digest)
+
+        self.wkitems = list(self.wkfiles.values())
+
+        # Keeps the selected map selected, where it was on screen, if it's still in the list.
+        self.widgets["ml_wkfiles"].setitems(self.wkitems)
+        # The selection is dropped without an event if the selected map was filtered out.
+        self.onselect()
 
     def openfolder(self, *args):
         """Open selected folder in File Explorer."""
 
         try:
-            name, src = self.getselected()
-            path = src.parent
-        except ValueError:
+            path = self.getselected().path.parent
+        except AttributeError:
             path = self.workshop_dir.get()
         try:
             is_dir = Path(path).is_dir()
@@ -287,8 +824,7 @@ class MainApp(tk.Tk):
         # Get default image from file
         path = Path(filename)
         if path.is_file():
-            im = Image.open(path)
-            im.thumbnail(self.img_size)
+            im = load_thumbnail(path, self.img_size)
             return ImageTk.PhotoImage(im)
 
         # Generate a default image from alt_text
@@ -304,51 +840,261 @@ class MainApp(tk.Tk):
     def changeimg(self):
         """Change to the preview image for the selected map.
 
-        Changes to the default image if no image is available or no map is selected.
+        Uses the preview loaded ahead of time by the prefetcher if there is one, and waits for it if it's loading,
+        which lets it download at full speed. Otherwise shows a placeholder while the preview is loaded in the
+        background. Changes to the default image if no image is available or no map is selected.
         """
 
-        filetypes = ("*.png", "*.jpg", "*.jpeg", "*.bmp")
-
         selection = self.getselected()
-        # Load default.png if it exists, else list is empty.
-        images = list()
-        if selection:
-            path = selection[1].parent
-            for ext in filetypes:
-                images.extend(Path(path).glob(ext))
-            size = self.img_size
-            if images:
-                im = Image.open(images[-1])
-                im.thumbnail(size)
-                self.image = ImageTk.PhotoImage(im)
-            elif CACHE_FOLDER.joinpath(path.name + ".png").is_file():
-                im = Image.open(CACHE_FOLDER.joinpath(path.name + ".png"))
-                self.image = ImageTk.PhotoImage(im)
-            else:
-                try:
-                    workshop_id = path.name
-                    im = WorkshopItem(workshop_id).get_img()
-                    im.thumbnail(size)
-                    im.save(CACHE_FOLDER.joinpath(workshop_id + ".png"), format="PNG")
-                    self.image = ImageTk.PhotoImage(im)
-                except ItemNotFoundError:
-                    self.image = self.img_default
+        if not selection:
+            self.preview_loader.cancel()
+            self.setpreview(None)
+            return
+        key = str(selection.path.parent)
+        photo = self.photo_cache.get(key)
+        if photo is not None:
+            self.preview_loader.cancel()
+            self.image = photo
+            self.widgets["l_preview"].configure(image=self.image)
+            return
+        self._preview_start = time.perf_counter()
+        im = self.prefetcher.get(key)
+        if im is not None:
+            self.preview_loader.cancel()
+            self.setpreview(im, key=key)
+            return
+        self.image = self.img_loading
+        self.widgets["l_preview"].configure(image=self.image)
+        if self.prefetcher.loading(key):
+            self.preview_loader.request(self.prefetcher.wait, partial(self.setpreview, key=key), key)
         else:
+            self.preview_loader.request(
+                self.loadpreview, partial(self.setpreview, key=key), selection, self.img_size
+            )
+
+    def setpreview(self, im, key=None):
+        """Display a PIL image as the preview image, or the default image if 'im' is None.
+
+        The displayed image is kept in the preview cache under 'key', if given.
+        """
+
+        if im is None:
             self.image = self.img_default
+        else:
+            self.image = ImageTk.PhotoImage(im)
+            if key is not None:
+                self.photo_cache.put(key, self.image)
         self.widgets["l_preview"].configure(image=self.image)
+        if key is not None:
+            # Time from selecting the map to showing its preview.
+            diagnostics.record("preview", time.perf_counter() - self._preview_start)
+
+    def loadpreview(self, entry, size):
+        """Return a thumbnail of the preview image for the map 'entry', or None if there isn't one.
+
+        See thumbs.loadpreview. Blocks, so it should be run on a worker thread.
+        """
+
+        return loadpreview(entry, size, self.disk_cache, self.wkindex)
+
+    def prefetchpreview(self, entry, hurry):
+        """Load the preview for 'entry' ahead of time, downloading no faster than PrefetchKBps. Blocks.
+
+        Downloads at full speed once the threading.Event 'hurry' is set, when the map has been selected.
+        """
+
+        limiter = self.prefetch_limiter and Throttle(self.prefetch_limiter, hurry)
+        return loadpreview(entry, self.img_size, self.disk_cache, self.wkindex, limiter=limiter)
 
-    def updateimg(self, previous=None, delay=100):
-        """Call the changeimg method if the map selection has changed.
+    def prefetchnearby(self, *args):
+        """Queue the previews of the maps around the selection and on screen to be loaded ahead of time.
 
-        Checks whether the selection has changed periodically. The period is specified by 'delay', in milliseconds.
-        Achieved by the function calling itself on a timer.
+        The maps nearest the selection are loaded first. Replaces the previous queue, so maps that have scrolled out of
+        view are dropped. Maps whose previews are already in the preview cache are left out.
         """
 
-        selected = self.getselected() or (None,)
-        name = selected[0]
-        if name != previous:
+        items = []
+        for entry in self.widgets["ml_wkfiles"].nearby(PREFETCH_NEIGHBOURS):
+            key = str(entry.path.parent)
+            if key not in self.photo_cache:
+                items.append((key, entry))
+        self.prefetcher.schedule(items)
+
+    def onselect(self, *args):
+        """Update the preview and details if the map selection has changed, and prefetch the previews around it."""
+
+        selected = self.getselected()
+        if selected != self._selected:
+            self._selected = selected
             self.changeimg()
-        self.after(delay, lambda: self.updateimg(previous=name))
+            self.showdetails()
+            self.prefetchnearby()
+
+    def runtask(self, func, callback, *args, poll=100):
+        """Run 'func(*args)' on a background thread and call 'callback(result, error)' on the Tk thread.
+
+        'result' is the return value of 'func', and 'error' is None, or the exception it raised, with 'result' None.
+        Checks whether the task has finished every 'poll' milliseconds until it has.
+        """
+
+        future = self.executor.submit(func, *args)
+
+        def check():
+            if future.done():
+                error = future.exception()
+                callback(None if error is not None else future.result(), error)
+            else:
+                self.after(poll, check)
+
+        self.after(poll, check)
+        return future
+
+    def warmpreviews(self):
+        """Download the details and previews of all maps in the workshop dir that aren't cached yet.
+
+        Runs in the background. Refills the listbox with any new titles when done.
+        """
+
+        from warmcache import warmcache
+
+        label = "Download all previews"
+        self.optionsmenu.entryconfig(label, state=tk.DISABLED)
+
+        def done(count, error):
+            self.optionsmenu.entryconfig(label, state=tk.NORMAL)
+            if error is not None:
+                msg.showerror(label, f"Couldn't fetch workshop items. Full Python exception:\n{repr(error)}")
+                return
+            self.buildsearch()
+            self.fillwslist()
+            msg.showinfo(label, f"Fetched {count} workshop items")
+
+        self.runtask(
+            warmcache, done, list(self.allwkfiles.values()), self.disk_cache, self.img_size, self.wkindex
+        )
+
+    def findduplicates(self):
+        """Hash the maps that could have duplicates and show a report of maps with the same contents.
+
+        Only maps that share their size with another map, and haven't been hashed since they last changed, are
+        hashed. Hashing runs in a pool of processes, with a progress window that can cancel it.
+        """
+
+        roots = self.workshopdirs()
+        entries = self.wkindex.unhashed(roots, shared_size=True)
+        dialog = ProgressDialog(self, "Find duplicate maps", f"Hashing {len(entries)} maps")
+
+        def work():
+            digests = hash_files([e.path for e in entries], progress=dialog.setprogress, cancel=dialog.cancelled)
+            self.wkindex.puthashes(entries, digests)
+            return self.wkindex.duplicates(roots)
+
+        def done(groups, error):
+            dialog.destroy()
+            if error is not None:
+                msg.showerror("Find duplicate maps", f"Couldn't hash maps. Full Python exception:\n{repr(error)}")
+                return
+            self.buildsearch()
+            self.fillwslist()
+            self.showduplicates(groups)
+
+        self.runtask(work, done)
+
+    def buildthumbnails(self):
+        """Make thumbnails of the preview images in all map folders, across a pool of processes.
+
+        Shows a progress window that can cancel it.
+        """
+
+        paths = list(dict.fromkeys(e.preview for e in self.allwkfiles.values() if e.preview is not None))
+        dialog = ProgressDialog(self, "Build thumbnails", f"Checking {len(paths)} preview images")
+
+        def work():
+            return build_thumbnails(
+                paths, self.disk_cache, self.img_size, progress=dialog.setprogress, cancel=dialog.cancelled
+            )
+
+        def done(added, error):
+            dialog.destroy()
+            if error is not None:
+                msg.showerror("Build thumbnails", f"Couldn't build thumbnails. Full Python exception:\n{repr(error)}")
+                return
+            msg.showinfo("Build thumbnails", f"Added {added} thumbnails to the cache")
+
+        self.runtask(work, done)
+
+    def showduplicates(self, groups):
+        """Show a window listing groups of maps with the same contents."""
+
+        window = tk.Toplevel(self)
+        window.title("Duplicate maps")
+        text = tk.Text(window, width=90, height=20, wrap=tk.NONE)
+        scrollbar = ttk.Scrollbar(window, command=text.yview)
+        text.config(yscrollcommand=scrollbar.set)
+        text.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        if not groups:
+            text.insert(tk.END, "No duplicate maps found.")
+        for group in groups:
+            size = group[0].size / 1024 ** 2
+            text.insert(tk.END, f"{len(group)} copies, {size:.1f} MB each:\n")
+            for entry in group:
+                text.insert(tk.END, f"    {self.displayname(entry)}: {entry.path}\n")
+            text.insert(tk.END, "\n")
+        text.config(state=tk.DISABLED)
+
+    def editworkshopdirs(self):
+        """Show a window for editing the extra workshop directories, one per line.
+
+        Maps from every directory are shown together in the list.
+        """
+
+        window = tk.Toplevel(self)
+        window.title("Other workshop folders")
+        ttk.Label(window, text="Workshop folders to include besides the main one, one per line:").pack(anchor="w")
+        text = tk.Text(window, width=70, height=6, wrap=tk.NONE)
+        text.pack(fill=tk.BOTH, expand=True)
+        text.insert(tk.END, "\n".join(self.extra_wkdirs))
+
+        def save():
+            lines = text.get("1.0", tk.END).splitlines()
+            self.extra_wkdirs = [line.strip() for line in lines if line.strip()]
+            window.destroy()
+            self.scanwkfiles()
+
+        ttk.Button(window, text="Save", command=save).pack(side=tk.RIGHT)
+        ttk.Button(window, text="Cancel", command=window.destroy).pack(side=tk.RIGHT)
+
+    def showdiagnostics(self):
+        """Show a window with the live counters and timings of hot operations, refreshed every second."""
+
+        window = tk.Toplevel(self)
+        window.title("Diagnostics")
+        text = tk.Text(window, width=100, height=24, wrap=tk.NONE)
+        text.pack(fill=tk.BOTH, expand=True)
+        ttk.Label(window, text=f"Log: {config.DIAGNOSTICS_LOG_PATH}").pack(anchor="w")
+
+        def refresh():
+            if not window.winfo_exists():
+                return
+            snapshot = diagnostics.snapshot()
+            lines = [f"{'Timing':<16}{'count':>8}{'mean ms':>10}{'p50 ms':>10}{'p95 ms':>10}{'max ms':>10}"]
+            for name, t in snapshot["timings"].items():
+                lines.append(
+                    f"{name:<16}{t['count']:>8}{t['mean_ms']:>10.1f}{t['p50_ms']:>10.1f}"
+                    f"{t['p95_ms']:>10.1f}{t['max_ms']:>10.1f}"
+                )
+            lines.append("")
+            lines.append(f"{'Counter':<24}{'value':>8}")
+            for name, value in snapshot["counters"].items():
+                lines.append(f"{name:<24}{value:>8}")
+            text.config(state=tk.NORMAL)
+            text.delete("1.0", tk.END)
+            text.insert(tk.END, "\n".join(lines))
+            text.config(state=tk.DISABLED)
+            window.after(1000, refresh)
+
+        refresh()
 
     def makemods(self, *args):
         """Tries to make a folder called 'mods' in the current mods directory.
@@ -420,7 +1166,7 @@ class MainApp(tk.Tk):
         )
         self.workshop_dir.trace("w", multi(
             partial(self.checkdir, self.widgets["e_wkdir"]),
-            self.fillwslist,
+            self.queuescan,
         ))
         self.widgets["e_wkdir"].grid(row=0, column=1)
         self.checkdir(self.widgets["e_wkdir"])
@@ -478,30 +1224,32 @@ class MainApp(tk.Tk):
             textvariable=self.search,
         )
         self.widgets["e_wksearch"].grid(row=1, column=1, sticky="we", pady=1)
-        self.search.trace("w", self.fillwslist)
+        self.search.trace("w", self.queuefilter)
         self.widgets["e_wksearch"].bind(
             "<FocusIn>",
             lambda event: event.widget.delete(0, tk.END),
         )
 
-        self.widgets["s_wkfiles"] = ttk.Scrollbar(self.frames["middle"])
-        self.widgets["s_wkfiles"].grid(row=2, column=2, rowspan=3, sticky="ns")
-
-        self.widgets["lb_wkfiles"] = tk.Listbox(
+        # Sort keys only use data already in memory, so sorting never touches the disk.
+        self.widgets["ml_wkfiles"] = MapList(
             self.frames["middle"],
+            columns=[
+                ("name", "Name", 200, lambda e: self.displayname(e).lower()),
+                ("size", "Size", 70, lambda e: e.size),
+                ("modified", "Modified", 80, lambda e: e.mtime),
+                ("activated", "Activated", 110, lambda e: self.activations.get(e.path, 0)),
+                ("package", "Package", 70, self.packagetext),
+            ],
+            formatrow=self.formatrow,
+            key=lambda e: e.path,
             height=9,
-            width=30,
-            highlightthickness=-1,
-            activestyle=tk.NONE,
-            relief=tk.SOLID,
-            selectmode=tk.SINGLE,
-            yscrollcommand=self.widgets["s_wkfiles"].set,
-            cursor="hand2"
         )
-        self.widgets["s_wkfiles"].config(command=self.widgets["lb_wkfiles"].yview)
-        self.widgets["lb_wkfiles"].insert(tk.END, *self.wkfiles.keys())
-        self.widgets["lb_wkfiles"].grid(row=2, column=1, rowspan=1)
-        self.widgets["lb_wkfiles"].bind("<Double-Button-1>", lambda event: self.copytolabs())
+        self.widgets["ml_wkfiles"].setitems(self.wkitems)
+        self.widgets["ml_wkfiles"].grid(row=2, column=1, rowspan=1)
+        self.widgets["ml_wkfiles"].bind("<<MapActivate>>", lambda event: self.copytolabs())
+        # Clicks and the arrow keys both generate this event.
+        self.widgets["ml_wkfiles"].bind("<<MapSelect>>", self.onselect)
+        self.widgets["ml_wkfiles"].bind("<<MapScroll>>", self.prefetchnearby)
 
         width, height = self.img_size
         self.widgets["l_preview"] = tk.Label(
@@ -515,9 +1263,15 @@ class MainApp(tk.Tk):
         self.changeimg()
         self.widgets["l_preview"].grid(row=1, column=0, rowspan=2)
 
+        self.widgets["l_details"] = ttk.Label(self.frames["middle"], wraplength=width)
+        self.widgets["l_details"].grid(row=3, column=0, sticky="n")
+
         self.frames["middle.right"] = ttk.Frame(self.frames["middle"])
         self.frames["middle.right"].grid(row=1, column=3, rowspan=2)
 
+        self.widgets["l_active"] = ttk.Label(self.frames["middle.right"], wraplength=120)
+        self.widgets["l_active"].grid(row=0, column=3, sticky="we", pady=(0, 4))
+
         self.widgets["b_tolabs"] = ttk.Button(
             self.frames["middle.right"],
             text="Activate",
@@ -547,6 +1301,10 @@ class MainApp(tk.Tk):
             label="Usage instructions",
             command=lambda: webbrowser.open(HELP_URL),
         )
+        self.helpmenu.add_command(
+            label="Diagnostics",
+            command=self.showdiagnostics,
+        )
 
         self.optionsmenu = tk.Menu(self, tearoff=0)
         self.optionsmenu.add_checkbutton(
@@ -563,6 +1321,37 @@ class MainApp(tk.Tk):
             onvalue=1,
             command=self.symlinkwarning,
         )
+        self.optionsmenu.add_checkbutton(
+            label="Show map titles",
+            var=self.show_titles,
+            offvalue=0,
+            onvalue=1,
+            command=self.fillwslist,
+        )
+        self.optionsmenu.add_checkbutton(
+            label="Hide duplicate maps",
+            var=self.hide_duplicates,
+            offvalue=0,
+            onvalue=1,
+            command=self.fillwslist,
+        )
+        self.optionsmenu.add_command(
+            label="Other workshop folders...",
+            command=self.editworkshopdirs,
+        )
+        self.optionsmenu.add_separator()
+        self.optionsmenu.add_command(
+            label="Download all previews",
+            command=self.warmpreviews,
+        )
+        self.optionsmenu.add_command(
+            label="Build thumbnails",
+            command=self.buildthumbnails,
+        )
+        self.optionsmenu.add_command(
+            label="Find duplicate maps",
+            command=self.findduplicates,
+        )
         self.optionsmenu.add_separator()
         self.optionsmenu.add_command(
             label="Exit",
@@ -578,9 +1367,21 @@ class MainApp(tk.Tk):
 def start():
     """Start the program."""
 
-    # Catch object to avoid garbage collection.
-    app = MainApp() # noqa
-    app.mainloop()
+    config.makefolders()
+    # Bring the window that is already open, or being opened, to the front instead of opening another.
+    lock = instance.claim()
+    if lock is None:
+        return
+    try:
+        diagnostics.openlog(config.DIAGNOSTICS_LOG_PATH)
+        profiler = diagnostics.startprofile()
+        # Catch object to avoid garbage collection.
+        app = MainApp()  # noqa
+        app.mainloop()
+        diagnostics.stopprofile(profiler, config.PROFILE_PATH)
+        diagnostics.closelog()
+    finally:
+        lock.release()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,243 @@
+from functools import partial
+import tkinter as tk
+from tkinter import ttk
+
+
+class MapList(ttk.Frame):
+    """Scrolling list of maps that only has widgets for the rows showing on screen.
+
+    The Treeview holds one row per line of the list's height, and scrolling changes which items those rows show, so
+    filling the list costs the same for ten maps as for a hundred thousand. Rows are only updated when their text
+    changes. Clicking a column heading sorts by that column, clicking it again reverses the order, and a third click
+    goes back to the order the items were given in.
+
+    Generates <<MapSelect>> when the user selects a different item, <<MapActivate>> when an item is double clicked
+    or Enter is pressed, and <<MapScroll>> when the items on screen change.
+    """
+
+    def __init__(self, master, columns, formatrow, key=None, height=9, **kwargs):
+        """Create the list with 'height' rows.
+
+        'columns' is a list of (name, heading, width, sortkey) tuples, where 'sortkey' is a function of an item to sort
+        the column by, or None if it can't be sorted. 'formatrow(item)' returns a tuple of the strings shown in each
+        column. Items with the same 'key(item)' are treated as the same item when the list is refilled.
+        """
+
+        super().__init__(master, **kwargs)
+        self.columns = columns
+        self.formatrow = formatrow
+        self.key = key or (lambda item: item)
+        self.height = height
+        # Items in the order they were given, and in the order they are shown.
+        self.items = []
+        self.view = []
+        self.top = 0
+        self.selected = None
+        self.sortby = None
+        self._selindex = None
+        self._selrow = None
+        # Items on screen at the last render, to tell when they change.
+        self._shown = None
+        # Values shown in each row, or None for rows that are hidden below the end of the list.
+        self._rows = [None] * height
+
+        names = [column[0] for column in columns]
+        self.tree = ttk.Treeview(
+            self, columns=names, show="headings", height=height, selectmode=tk.NONE, cursor="hand2"
+        )
+        for name, heading, width, sortkey in columns:
+            self.tree.column(name, width=width, minwidth=width, stretch=name == names[0])
+            self.tree.heading(name, text=heading)
+            if sortkey is not None:
+                self.tree.heading(name, command=partial(self.sort, name))
+        for i in range(height):
+            self.tree.insert("", tk.END, iid=str(i))
+            self.tree.detach(str(i))
+        self.scrollbar = ttk.Scrollbar(self, command=self.yview)
+        self.tree.grid(row=0, column=0, sticky="nsew")
+        self.scrollbar.grid(row=0, column=1, sticky="ns")
+
+        self.tree.bind("<Button-1>", self.onclick)
+        self.tree.bind("<Double-Button-1>", self.ondoubleclick)
+        self.tree.bind("<MouseWheel>", lambda event: self.scroll(-3 if event.delta > 0 else 3))
+        self.tree.bind("<Button-4>", lambda event: self.scroll(-3))
+        self.tree.bind("<Button-5>", lambda event: self.scroll(3))
+        for key, step in (("<Up>", -1), ("<Down>", 1), ("<Prior>", -height), ("<Next>", height)):
+            self.tree.bind(key, partial(self.movekey, step))
+        self.tree.bind("<Home>", lambda event: self.select(0) or "break")
+        self.tree.bind("<End>", lambda event: self.select(len(self.view) - 1) or "break")
+        self.tree.bind("<Return>", lambda event: self.event_generate("<<MapActivate>>"))
+
+    def setitems(self, items):
+        """Show 'items', sorted by the current sort column if there is one.
+
+        The selected item stays selected, at the same place on screen, if an item with the same key is still in the
+        list. Otherwise the selection is cleared. Doesn't generate <<MapSelect>>.
+        """
+
+        offset = None if self._selindex is None else self._selindex - self.top
+        self.items = list(items)
+        self._applysort()
+        self._selindex = None
+        if self.selected is not None:
+            selkey = self.key(self.selected)
+            self.selected = None
+            for i, item in enumerate(self.view):
+                if self.key(item) == selkey:
+                    self.selected = item
+                    self._selindex = i
+                    break
+        if self._selindex is not None and offset is not None and 0 <= offset < self.height:
+            self.top = self._selindex - offset
+        self._clamp()
+        self.render()
+
+    def refresh(self):
+        """Show the items again, after the text or sort order of some of them has changed."""
+
+        self.setitems(self.items)
+
+    def sort(self, name):
+        """Sort by the column 'name', then in reverse, then in the original order, on successive calls."""
+
+        if self.sortby == (name, False):
+            self.sortby = (name, True)
+        elif self.sortby == (name, True):
+            self.sortby = None
+        else:
+            self.sortby = (name, False)
+        for column, heading, width, sortkey in self.columns:
+            if self.sortby is not None and column == self.sortby[0]:
+                heading += " ▼" if self.sortby[1] else " ▲"
+            self.tree.heading(column, text=heading)
+        self._applysort()
+        if self.selected is not None:
+            self._selindex = self.view.index(self.selected)
+            self.see(self._selindex)
+        self._clamp()
+        self.render()
+
+    def _applysort(self):
+        if self.sortby is None:
+            self.view = list(self.items)
+            return
+        name, reverse = self.sortby
+        sortkey = next(column[3] for column in self.columns if column[0] == name)
+        # Sorting is stable, so items that tie stay in the order they were given.
+        self.view = sorted(self.items, key=sortkey, reverse=reverse)
+
+    def select(self, index):
+        """Select the item at 'index' in the shown order, scroll it into view and generate <<MapSelect>>."""
+
+        if not self.view:
+            return
+        index = max(0, min(index, len(self.view) - 1))
+        changed = index != self._selindex
+        self.selected = self.view[index]
+        self._selindex = index
+        self.see(index)
+        self.render()
+        if changed:
+            self.event_generate("<<MapSelect>>")
+
+    def see(self, index):
+        if index < self.top:
+            self.top = index
+        elif index >= self.top + self.height:
+            self.top = index - self.height + 1
+        self._clamp()
+
+    def scroll(self, rows):
+        self.top += rows
+        self._clamp()
+        self.render()
+
+    def yview(self, *args):
+        """Scroll as told by the scrollbar."""
+
+        if args[0] == "moveto":
+            self.top = round(float(args[1]) * len(self.view))
+        elif args[0] == "scroll":
+            self.top += int(args[1]) * (self.height if args[2] == "pages" else 1)
+        self._clamp()
+        self.render()
+
+    def _clamp(self):
+        self.top = max(0, min(self.top, len(self.view) - self.height))
+
+    def render(self):
+        """Update the rows on screen to show the items from 'top' on, changing only the rows that differ."""
+
+        for row in range(self.height):
+            index = self.top + row
+            iid = str(row)
+            if index < len(self.view):
+                values = tuple(self.formatrow(self.view[index]))
+                if self._rows[row] is None:
+                    self.tree.move(iid, "", row)
+                if values != self._rows[row]:
+                    self.tree.item(iid, values=values)
+                self._rows[row] = values
+            elif self._rows[row] is not None:
+                self.tree.detach(iid)
+                self._rows[row] = None
+
+        selrow = None
+        if self._selindex is not None and self.top <= self._selindex < self.top + self.height:
+            selrow = str(self._selindex - self.top)
+        if selrow != self._selrow:
+            self.tree.selection_set(selrow or ())
+            self._selrow = selrow
+
+        count = len(self.view)
+        if count <= self.height:
+            self.scrollbar.set(0, 1)
+        else:
+            self.scrollbar.set(self.top / count, (self.top + self.height) / count)
+
+        shown = [self.key(item) for item in self.view[self.top:self.top + self.height]]
+        if shown != self._shown:
+            self._shown = shown
+            self.event_generate("<<MapScroll>>")
+
+    def nearby(self, count):
+        """Return the items the user is likely to look at next, most likely first, leaving out the selected item.
+
+        These are the 'count' items on each side of the selection, nearest first and those below before those above,
+        followed by the other items on screen in the same order. Without a selection, the items on screen top down.
+        """
+
+        stop = min(self.top + self.height, len(self.view))
+        if self._selindex is None:
+            return self.view[self.top:stop]
+        center = self._selindex
+        indexes = set(range(max(center - count, 0), min(center + count + 1, len(self.view))))
+        indexes.update(range(self.top, stop))
+        indexes.discard(center)
+        order = sorted(indexes, key=lambda i: (abs(i - center) > count, abs(i - center), i < center))
+        return [self.view[i] for i in order]
+
+    def rowindex(self, event):
+        """Return the index of the item in the row under the mouse, or None if it isn't over an item."""
+
+        if self.tree.identify_region(event.x, event.y) != "cell":
+            return None
+        row = self.tree.identify_row(event.y)
+        return self.top + int(row) if row else None
+
+    def onclick(self, event):
+        self.tree.focus_set()
+        index = self.rowindex(event)
+        if index is not None:
+            self.select(index)
+
+    def ondoubleclick(self, event):
+        if self.rowindex(event) is not None:
+            self.event_generate("<<MapActivate>>")
+
+    def movekey(self, step, event):
+        if self._selindex is None:
+            self.select(self.top)
+        else:
+            self.select(self._selindex + step)
+        return "break"
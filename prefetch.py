@@ -0,0 +1,184 @@
+"""Load previews ahead of time, for the maps the user is likely to look at next."""
+
+from collections import OrderedDict
+import heapq
+import itertools
+import threading
+import time
+import traceback
+
+import diagnostics
+
+
+class RateLimiter:
+    """Keeps the average rate of downloads that report to it under 'rate' bytes per second, across threads.
+
+    A download that goes over the rate delays the next ones, by sleeping in 'consume'.
+    """
+
+    def __init__(self, rate):
+        self.rate = rate
+        self._next = time.monotonic()
+        self._lock = threading.Lock()
+
+    def consume(self, nbytes, hurry=None):
+        """Count 'nbytes' against the rate, sleeping until the rate allows them.
+
+        Returns at once if the threading.Event 'hurry' is set, or as soon as it's set while sleeping.
+        """
+
+        if hurry is not None and hurry.is_set():
+            return
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next)
+            self._next = start + nbytes / self.rate
+        if start > now:
+            if hurry is None:
+                time.sleep(start - now)
+            else:
+                hurry.wait(start - now)
+
+
+class Throttle:
+    """Counts the downloads of one load against the RateLimiter 'limiter', until the threading.Event 'hurry' is set.
+
+    Can be passed anywhere a RateLimiter can.
+    """
+
+    def __init__(self, limiter, hurry):
+        self.limiter = limiter
+        self.hurry = hurry
+
+    def consume(self, nbytes):
+        self.limiter.consume(nbytes, self.hurry)
+
+
+class Prefetcher:
+    """Load images on a few worker threads, in order of priority, keeping the results in memory.
+
+    'load(item, hurry)' returns the image for an item, or None if there isn't one. 'hurry' is a threading.Event that
+    is set once someone waits for the image, after which the load shouldn't hold back, such as by passing it to a
+    Throttle. The queue is replaced as a whole by 'schedule', so items that are no longer wanted, such as maps that
+    have scrolled out of view, are dropped before they're started. Loads that have started always finish, and their
+    images are kept, since they may be wanted again. Only 'workers' loads run at once. The last 'keep' images are
+    kept, least recently used first out.
+    """
+
+    def __init__(self, load, workers=2, keep=64):
+        self.load = load
+        self.keep = keep
+        self._cond = threading.Condition()
+        self._stopped = False
+        # Heap of (priority, order, key), with the item of each queued key in '_wanted'.
+        self._heap = []
+        self._wanted = {}
+        self._order = itertools.count()
+        # Keys being loaded, with the Event that hurries each load.
+        self._running = {}
+        self._ready = OrderedDict()
+        self._threads = [
+            threading.Thread(target=self._work, name=f"prefetch-{i}", daemon=True) for i in range(workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def schedule(self, items):
+        """Replace the queue with 'items', a list of (key, item) pairs with the most wanted first.
+
+        Items that are already loaded or loading are skipped.
+        """
+
+        with self._cond:
+            self._wanted = {}
+            self._heap = []
+            for priority, (key, item) in enumerate(items):
+                if key in self._ready or key in self._running or key in self._wanted:
+                    continue
+                self._wanted[key] = item
+                self._heap.append((priority, next(self._order), key))
+            heapq.heapify(self._heap)
+            self._cond.notify_all()
+
+    def get(self, key):
+        """Return the loaded image for 'key', or None if it hasn't been loaded."""
+
+        with self._cond:
+            image = self._ready.get(key)
+            if image is not None:
+                self._ready.move_to_end(key)
+        diagnostics.count("prefetch.hit" if image is not None else "prefetch.miss")
+        return image
+
+    def loading(self, key):
+        """Return True if 'key' is being loaded right now."""
+
+        with self._cond:
+            return key in self._running
+
+    def wait(self, key):
+        """Wait for 'key' to finish loading if it's loading, and return its image, or None if there isn't one.
+
+        The load is hurried, since someone is now waiting for it.
+        """
+
+        with self._cond:
+            hurry = self._running.get(key)
+            if hurry is not None:
+                hurry.set()
+            while key in self._running:
+                self._cond.wait()
+            return self._ready.get(key)
+
+    def discard(self, key):
+        """Forget the image for 'key', after its map has changed."""
+
+        with self._cond:
+            self._ready.pop(key, None)
+
+    def shutdown(self):
+        """Stop the workers once their current loads finish, without waiting for them."""
+
+        with self._cond:
+            self._stopped = True
+            self._heap = []
+            self._wanted = {}
+            self._cond.notify_all()
+
+    def _next(self):
+        """Wait for the most wanted queued key, and mark it as running.
+
+        Returns the key, its item and the Event that hurries its load, or None once shut down.
+        """
+
+        with self._cond:
+            while True:
+                while not self._heap and not self._stopped:
+                    self._cond.wait()
+                if self._stopped:
+                    return None
+                key = heapq.heappop(self._heap)[2]
+                item = self._wanted.pop(key, None)
+                if item is not None:
+                    hurry = self._running[key] = threading.Event()
+                    return key, item, hurry
+
+    def _work(self):
+        while True:
+            job = self._next()
+            if job is None:
+                return
+            key, item, hurry = job
+            image = None
+            try:
+                with diagnostics.timer("prefetch"):
+                    image = self.load(item, hurry)
+            except Exception:
+                traceback.print_exc()
+            with self._cond:
+                del self._running[key]
+                if image is not None:
+                    self._ready[key] = image
+                    while len(self._ready) > self.keep:
+                        self._ready.popitem(last=False)
+                self._cond.notify_all()
@@ -0,0 +1,73 @@
+from concurrent.futures import ThreadPoolExecutor
+import queue
+import traceback
+
+
+class PreviewLoader:
+    """Load preview images on worker threads and hand the results back to Tk.
+
+    Results are delivered on the Tk thread by polling a queue with 'widget.after', only while requests are pending.
+    Only the most recent request is delivered. Older requests are cancelled if they haven't started yet, and their
+    results are ignored otherwise.
+    """
+
+    def __init__(self, widget, workers=4, poll=15):
+        self.widget = widget
+        # Polling period in milliseconds while requests are pending.
+        self.poll = poll
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="preview")
+        self._results = queue.Queue()
+        self._token = 0
+        self._future = None
+        self._pending = 0
+        self._after_id = None
+
+    def request(self, func, callback, *args):
+        """Run 'func(*args)' on a worker thread and pass its return value to 'callback' on the Tk thread.
+
+        'callback' is given None if 'func' raised an exception. Cancels any previous request.
+        """
+
+        self._token += 1
+        token = self._token
+        if self._future is not None:
+            self._future.cancel()
+        self._future = self._executor.submit(func, *args)
+        self._pending += 1
+        self._future.add_done_callback(lambda future: self._results.put((token, callback, future)))
+        if self._after_id is None:
+            self._after_id = self.widget.after(self.poll, self._deliver)
+
+    def cancel(self):
+        """Cancel the current request, if any."""
+
+        self._token += 1
+        if self._future is not None:
+            self._future.cancel()
+            self._future = None
+
+    def shutdown(self):
+        self.cancel()
+        if self._after_id is not None:
+            self.widget.after_cancel(self._after_id)
+            self._after_id = None
+        self._executor.shutdown(wait=False)
+
+    def _deliver(self):
+        self._after_id = None
+        while True:
+            try:
+                token, callback, future = self._results.get_nowait()
+            except queue.Empty:
+                break
+            self._pending -= 1
+            if token != self._token or future.cancelled():
+                continue
+            try:
+                result = future.result()
+            except Exception:
+                traceback.print_exc()
+                result = None
+            callback(result)
+        if self._pending:
+            self._after_id = self.widget.after(self.poll, self._deliver)
@@ -1,39 +1,277 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import html
 from io import BytesIO
 import re
+import threading
+import time
+from urllib.parse import urlencode, urlsplit, urlunsplit
 
-from bs4 import BeautifulSoup
 from PIL import Image
 import requests
+from requests.adapters import HTTPAdapter
+
+import diagnostics
 
 
 BASE_URL = "https://steamcommunity.com/sharedfiles/filedetails/?id=%s"
+# Seconds to wait for a connection, and then for each read from the server, before giving up on a request.
+CONNECT_TIMEOUT = 3.05
+READ_TIMEOUT = 10
+TIMEOUT = (CONNECT_TIMEOUT, READ_TIMEOUT)
+# Times a request is tried again after a connection error, timeout or server error, waiting BACKOFF seconds before
+# the first retry and twice as long before each one after.
+RETRIES = 2
+BACKOFF = 0.5
+RETRY_STATUSES = frozenset((429, 500, 502, 503, 504))
+# Seconds for which an item that doesn't exist isn't looked up again.
+NOT_FOUND_TTL = 24 * 60 * 60
+# Number of items fetched at the same time by fetch_items.
+WORKERS = 8
+
+# Matches the title element whatever other classes or attributes it has, so small changes to Steam's markup don't
+# make every item look missing.
+TITLE_PATTERN = re.compile(
+    r"<div\b[^>]*?\bclass\s*=\s*[\"'][^\"']*?(?<![\w-])workshopItemTitle(?![\w-])[^>]*>(?P<title>.*?)</div>",
+    re.DOTALL,
+)
+PREVIEW_PATTERN = re.compile(r"ShowEnlargedImagePreview\(\s*'(?P<url>[^']+)'\s*\);")
+TAG_PATTERN = re.compile(r"<[^>]*>")
 
 
 class ItemNotFoundError(Exception):
     pass
 
 
+class FetchError(ItemNotFoundError):
+    """Raised when Steam couldn't be reached, or kept failing, so the item may still exist."""
+
+
+class OfflineError(FetchError):
+    """Raised without making a request while the circuit breaker is open."""
+
+
+class CircuitBreaker:
+    """Stops requests to Steam for a while once several have failed in a row.
+
+    After 'threshold' failed requests the breaker opens, and requests fail at once with OfflineError for 'cooldown'
+    seconds. After that, requests are let through again, and the first failure opens the breaker again.
+    Safe to use from several threads.
+    """
+
+    def __init__(self, threshold=3, cooldown=60):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self._opened = None
+        self._lock = threading.Lock()
+
+    @property
+    def offline(self):
+        opened = self._opened
+        return opened is not None and time.monotonic() - opened < self.cooldown
+
+    def check(self):
+        """Raise OfflineError if requests shouldn't be made right now."""
+
+        if self.offline:
+            diagnostics.count("http.offline")
+            raise OfflineError
+
+    def success(self):
+        with self._lock:
+            self.failures = 0
+            self._opened = None
+
+    def failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.failures >= self.threshold:
+                self._opened = time.monotonic()
+
+
+# Breaker shared by all requests to Steam.
+breaker = CircuitBreaker()
+
+
+class ItemInfo:
+    """Details of a workshop item extracted from its page.
+
+    Also holds the time the page was fetched and the validators the server sent with it, for conditional requests.
+    """
+
+    __slots__ = ("id", "title", "preview_url", "fetched", "etag", "last_modified")
+
+    def __init__(self, _id, title, preview_url, fetched=None, etag=None, last_modified=None):
+        self.id = _id
+        self.title = title
+        self.preview_url = preview_url
+        self.fetched = fetched
+        self.etag = etag
+        self.last_modified = last_modified
+
+    def __repr__(self):
+        return f"ItemInfo({self.id!r}, {self.title!r}, {self.preview_url!r})"
+
+
+def parse_item(_id, page):
+    """Extract the title and preview image URL from the HTML of a workshop page.
+
+    Only scans for the few elements that are needed, instead of parsing the whole page.
+    Returns an ItemInfo, whose 'preview_url' is None if the item has no preview. Raises ItemNotFoundError if the page
+    isn't a workshop item.
+    """
+
+    match = TITLE_PATTERN.search(page)
+    if match is None:
+        raise ItemNotFoundError
+    title = html.unescape(TAG_PATTERN.sub("", match["title"]))
+
+    # The enlarged image's URL is in the 'onclick' attribute of the preview image's parent.
+    preview_url = None
+    pos = page.find("workshopItemPreviewImageEnlargeable")
+    img_start = page.rfind("<img", 0, pos) if pos != -1 else -1
+    if img_start > 0:
+        parent_start = page.rfind("<", 0, img_start)
+        match = PREVIEW_PATTERN.search(page, parent_start, img_start)
+        if match is not None:
+            preview_url = html.unescape(match["url"])
+    return ItemInfo(_id, title, preview_url)
+
+
+def get(url, session=None, timer="http", limiter=None, **kwargs):
+    """Send a GET request for 'url' with TIMEOUT, retrying connection errors, timeouts and server errors.
+
+    Waits longer between each retry, as set by RETRIES and BACKOFF. Each try is timed as 'timer' in diagnostics.
+    The size of the response is reported to 'limiter', a prefetch.RateLimiter, if given.
+    Returns the response, whatever its status, once the server answers without an error. Raises FetchError if every
+    try fails, and OfflineError without trying if the circuit breaker is open.
+    """
+
+    breaker.check()
+    kwargs.setdefault("timeout", TIMEOUT)
+    for attempt in range(RETRIES + 1):
+        if attempt:
+            time.sleep(BACKOFF * 2 ** (attempt - 1))
+        try:
+            with diagnostics.timer(timer):
+                response = (session or requests).get(url, **kwargs)
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+            continue
+        if response.status_code not in RETRY_STATUSES:
+            breaker.success()
+            if limiter is not None:
+                limiter.consume(len(response.content))
+            return response
+    breaker.failure()
+    raise FetchError
+
+
+def make_session(pool_size=WORKERS):
+    """Return a requests session that keeps up to 'pool_size' connections open per host."""
+
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def sized_url(url, size):
+    """Return the URL of a preview image on Steam's image server, scaled down to fit within 'size'."""
+
+    parts = urlsplit(url)
+    params = urlencode({"imw": size[0], "imh": size[1], "ima": "fit"})
+    query = f"{parts.query}&{params}" if parts.query else params
+    return urlunsplit(parts._replace(query=query))
+
+
+def download_img(url, session=None, size=None, limiter=None):
+    """Download and open the image at 'url'.
+
+    If 'size' is given, asks the image server for a copy scaled down to fit within it, instead of the full image.
+    Raises FetchError if the server can't be reached. The download counts against 'limiter', a prefetch.RateLimiter,
+    if given.
+    """
+
+    if size is not None:
+        url = sized_url(url, size)
+    response = get(url, session, timer="http.image", limiter=limiter)
+    return Image.open(BytesIO(response.content))
+
+
 class WorkshopItem:
-    def __init__(self, _id):
+    """A workshop item fetched from its Steam page.
+
+    If details from an earlier fetch are passed as 'cached', the page is only downloaded again if it has changed
+    since, going by its ETag and Last-Modified validators. 'modified' is False if the cached details were reused.
+    Raises ItemNotFoundError if there's no such item, or FetchError if Steam can't be reached. Downloads of the page
+    and image count against 'limiter', a prefetch.RateLimiter, if given.
+    """
+
+    def __init__(self, _id, session=None, base_url=BASE_URL, cached=None, limiter=None):
         self.id = str(_id)
-        try:
-            response = requests.get(BASE_URL % self.id)
-        except requests.exceptions.ConnectionError:
-            raise ItemNotFoundError
-        html = response.text
-        self.soup = BeautifulSoup(html, "lxml")
-        elem = self.soup.find("div", class_="workshopItemTitle")
-        if elem is None:
+        self.session = session or requests
+        self.limiter = limiter
+        headers = {}
+        if cached is not None:
+            if cached.etag:
+                headers["If-None-Match"] = cached.etag
+            if cached.last_modified:
+                headers["If-Modified-Since"] = cached.last_modified
+        response = get(base_url % self.id, self.session, timer="http.page", limiter=limiter, headers=headers)
+        if response.status_code == 304 and cached is not None:
+            self.modified = False
+            info = ItemInfo(
+                self.id, cached.title, cached.preview_url, etag=cached.etag, last_modified=cached.last_modified
+            )
+        else:
+            self.modified = True
+            info = parse_item(self.id, response.text)
+            info.etag = response.headers.get("ETag")
+            info.last_modified = response.headers.get("Last-Modified")
+        info.fetched = time.time()
+        self.info = info
+        self.title = info.title
+        self.preview_url = info.preview_url
+
+    def get_img(self, size=None):
+        if self.preview_url is None:
             raise ItemNotFoundError
-        self.title = elem.text
-
-    def get_img(self):
-        javascript = self.soup.find("img", class_="workshopItemPreviewImageEnlargeable").parent["onclick"]
-        pattern = re.compile(r"ShowEnlargedImagePreview\(\s*'(?P<url>.+)'\s*\);")
-        img_url = pattern.match(javascript)["url"]
-        response = requests.get(img_url)
-        im = Image.open(BytesIO(response.content))
-        return im
+        return download_img(self.preview_url, self.session, size, self.limiter)
+
+
+def fetch_items(ids, func=None, workers=WORKERS, session=None, base_url=BASE_URL, cached=None, notfound=None):
+    """Fetch many workshop items at the same time over one pooled session.
+
+    Yields (id, result) pairs as items finish, in no particular order. The result is the WorkshopItem, or the return
+    value of 'func(item)' if 'func' is given, so slow follow-up work like downloading images also runs concurrently.
+    The result is None if the item couldn't be fetched.
+    'cached' can map IDs to details from earlier fetches, to make conditional requests. 'notfound(id)' is called, if
+    given, for items that don't exist, but not for those that couldn't be fetched because Steam couldn't be reached.
+    """
+
+    if session is None:
+        session = make_session(workers)
+    if cached is None:
+        cached = {}
+
+    def fetch(_id):
+        try:
+            item = WorkshopItem(_id, session=session, base_url=base_url, cached=cached.get(_id))
+            return item if func is None else func(item)
+        except FetchError:
+            return None
+        except ItemNotFoundError:
+            if notfound is not None:
+                notfound(_id)
+            return None
+        except (requests.exceptions.RequestException, OSError):
+            return None
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="fetch") as executor:
+        futures = {executor.submit(fetch, _id): _id for _id in ids}
+        for future in as_completed(futures):
+            yield futures[future], future.result()
 
 
 if __name__ == "__main__":
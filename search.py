@@ -0,0 +1,182 @@
+from collections import Counter, defaultdict
+from math import ceil
+import re
+
+
+# Characters that start a new word in a map name.
+SEPARATORS = frozenset(" _-.()[]\n")
+WORD_SPLIT = re.compile("[" + re.escape("".join(sorted(SEPARATORS))) + "]+")
+# Fraction of a query's trigrams that a name must contain to be a fuzzy match.
+FUZZY_THRESHOLD = 0.6
+# Queries shorter than this have no trigrams, and only match at the start of a text or of a word in it.
+SHORT_QUERY = 3
+# Edits, including swapping two neighbouring characters, that a word may be from a query and still match it.
+TYPO_EDITS = 1
+LONG_TYPO_EDITS = 2
+# Queries at least this long may be LONG_TYPO_EDITS from a word.
+LONG_TYPO = 8
+
+
+def trigrams(text):
+    """Return the set of three character substrings of 'text'."""
+
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+def editdistance(a, b, limit):
+    """Return the number of edits between 'a' and 'b', or 'limit' + 1 if it's more than 'limit'.
+
+    An edit inserts, deletes or replaces a character, or swaps two neighbouring ones.
+    """
+
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    before = None
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i]
+        for j, cb in enumerate(b, 1):
+            cost = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ca != cb))
+            if i > 1 and j > 1 and ca == b[j - 2] and a[i - 2] == cb:
+                cost = min(cost, before[j - 2] + 1)
+            current.append(cost)
+        if min(current) > limit:
+            return limit + 1
+        before, previous = previous, current
+    return min(previous[-1], limit + 1)
+
+
+class SearchIndex:
+    """Trigram index over a list of texts, built once per scan.
+
+    Searches return the positions of matching texts, ranked with prefix matches first, then matches at the start of a
+    word, then matches anywhere. Texts with a word a typo or two away from the query, then texts that share most of
+    the query's trigrams, follow as fuzzy matches. When a query extends the previous one, as it does while typing,
+    only the previous matches are searched.
+
+    Queries of one or two characters are looked up in lists of the texts starting with them, and of the texts with a
+    word starting with them, rather than searched for. A character or two in the middle of a word matches most names
+    and tells little about them.
+    """
+
+    def __init__(self, texts):
+        self.texts = [t.lower() for t in texts]
+        self.postings = defaultdict(list)
+        # Texts by their first one and two characters.
+        self.prefixes = defaultdict(list)
+        # Texts by the words in them, and words by their trigrams, for finding words close to a query.
+        self.words = defaultdict(list)
+        self.wordgrams = defaultdict(list)
+        for i, text in enumerate(self.texts):
+            for gram in trigrams(text):
+                self.postings[gram].append(i)
+            self.prefixes[text[:1]].append(i)
+            if len(text) > 1:
+                self.prefixes[text[:2]].append(i)
+            for word in set(WORD_SPLIT.split(text)):
+                self.words[word].append(i)
+        self.words.pop("", None)
+        for word in self.words:
+            for gram in trigrams(word):
+                self.wordgrams[gram].append(word)
+        # Matches of short queries, worked out from the words when first searched for.
+        self._short = {}
+        # Query and exact matches of the last search.
+        self._last = ("", range(len(self.texts)))
+
+    def __len__(self):
+        return len(self.texts)
+
+    def search(self, query, fuzzy=True):
+        """Return a list of positions of texts matching 'query', best matches first."""
+
+        query = query.strip().lower()
+        if not query:
+            return list(range(len(self.texts)))
+        if len(query) < SHORT_QUERY and SEPARATORS.isdisjoint(query):
+            # These aren't remembered as the last search, as they leave out matches inside words.
+            return list(self._startswith(query))
+
+        last_query, last_matches = self._last
+        if query == last_query:
+            results = list(last_matches)
+        else:
+            results = self._match(query, last_query, last_matches)
+            self._last = (query, results)
+        grams = trigrams(query)
+        if fuzzy and len(grams) > 1:
+            seen = set(results)
+            typos = self._typos(query, seen)
+            seen.update(typos)
+            results = results + typos + self._fuzzy(grams, seen)
+        return results
+
+    def _startswith(self, query):
+        results = self._short.get(query)
+        if results is None:
+            prefixes = self.prefixes.get(query, [])
+            words = set()
+            for word, positions in self.words.items():
+                if word.startswith(query):
+                    words.update(positions)
+            words.difference_update(prefixes)
+            results = self._short[query] = prefixes + sorted(words)
+        return results
+
+    def _match(self, query, last_query, last_matches):
+        grams = trigrams(query)
+        if grams:
+            # Every match contains every trigram of the query, so the shortest posting list holds all of them.
+            candidates = min((self.postings.get(g, ()) for g in grams), key=len)
+        else:
+            candidates = range(len(self.texts))
+        if last_query in query and len(last_matches) < len(candidates):
+            candidates = sorted(last_matches)
+
+        texts = self.texts
+        found = [(texts[i].find(query), i) for i in candidates]
+        results = [i for pos, i in found if pos == 0]
+        words = []
+        others = []
+        for pos, i in found:
+            if pos > 0:
+                if texts[i][pos - 1] in SEPARATORS:
+                    words.append(i)
+                else:
+                    others.append(i)
+        results.extend(words)
+        results.extend(others)
+        return results
+
+    def _typos(self, query, exclude):
+        # A typo changes at most three of a word's trigrams, so any word with a few edits of a longer query shares one.
+        limit = LONG_TYPO_EDITS if len(query) >= LONG_TYPO else TYPO_EDITS
+        words = {w for g in trigrams(query) for w in self.wordgrams.get(g, ())}
+        edits = {}
+        for word in words:
+            # Words longer than the query may be still being typed, so are also compared by their start.
+            distance = min(
+                editdistance(query, word[:n], limit)
+                for n in range(len(query) - limit, len(query) + limit + 1)
+                if n <= len(word)
+            ) if len(word) > len(query) else editdistance(query, word, limit)
+            if distance > limit:
+                continue
+            for i in self.words[word]:
+                if i not in exclude and edits.get(i, limit + 1) > distance:
+                    edits[i] = distance
+        return sorted(edits, key=lambda i: (edits[i], i))
+
+    def _fuzzy(self, grams, exclude):
+        # Trigrams found in most texts don't tell them apart, and are expensive to count.
+        limit = max(len(self.texts) // 2, 1)
+        useful = [g for g in grams if len(self.postings.get(g, ())) <= limit]
+        needed = ceil(len(grams) * FUZZY_THRESHOLD) - (len(grams) - len(useful))
+        if not useful or needed < 1:
+            return []
+        counts = Counter()
+        for gram in useful:
+            counts.update(self.postings.get(gram, ()))
+        matches = [(-n, i) for i, n in counts.items() if n >= needed and i not in exclude]
+        matches.sort()
+        return [i for n, i in matches]
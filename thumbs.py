@@ -0,0 +1,150 @@
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import hashlib
+import os
+import time
+
+from PIL import Image
+
+import diagnostics
+
+
+@diagnostics.timed("decode")
+def load_thumbnail(path, size):
+    """Open an image and shrink it to fit within 'size', decoding as little of it as possible.
+
+    JPEGs are decoded straight at a reduced scale with draft. Other formats are first shrunk by a whole factor with
+    reduce, which is much cheaper than resampling the full image.
+    """
+
+    im = Image.open(path)
+    if im.format == "JPEG":
+        im.draft("RGB", size)
+    # Palette and other modes can't be reduced.
+    if im.mode not in ("L", "RGB", "RGBA"):
+        im = im.convert("RGBA" if "transparency" in im.info or "A" in im.mode else "RGB")
+    factor = min(im.width // size[0], im.height // size[1])
+    if factor >= 2:
+        im = im.reduce(factor)
+    im.thumbnail(size)
+    return im
+
+
+def thumbkey(path):
+    """Return the image cache key for a thumbnail of the image at 'path'.
+
+    The key changes whenever the image file does. Raises OSError if the file can't be found.
+    """
+
+    stat = os.stat(path)
+    digest = hashlib.blake2b(f"{os.path.abspath(path)}|{stat.st_size}|{stat.st_mtime_ns}".encode(), digest_size=8)
+    return "local-" + digest.hexdigest()
+
+
+def _thumbnail(path, size):
+    try:
+        return load_thumbnail(path, size)
+    except OSError:
+        return None
+
+
+def build_thumbnails(paths, cache, size, workers=None, progress=None, cancel=None):
+    """Make thumbnails of the images at 'paths' that aren't in 'cache' yet, across a pool of processes.
+
+    'progress(done, total)' is called as images finish. If the threading.Event 'cancel' is set, images that haven't
+    started are skipped. Returns the number of thumbnails added to the cache.
+    """
+
+    missing = {}
+    for path in paths:
+        try:
+            key = thumbkey(path)
+        except OSError:
+            continue
+        if key not in cache:
+            missing[key] = path
+    added = 0
+    if not missing:
+        return added
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(_thumbnail, path, size): key for key, path in missing.items()}
+        for done, future in enumerate(as_completed(futures), 1):
+            if future.cancelled():
+                continue
+            im = future.result()
+            if im is not None:
+                cache.put(futures[future], im)
+                added += 1
+            if progress is not None:
+                progress(done, len(futures))
+            if cancel is not None and cancel.is_set():
+                for f in futures:
+                    f.cancel()
+    cache.flush()
+    return added
+
+
+def loadpreview(entry, size, cache, index, base_url=None, limiter=None):
+    """Return a thumbnail of the preview image for the map 'entry', or None if there isn't one.
+
+    Uses the image found in the map folder first, then the image cache 'cache', and finally downloads the image from
+    Steam. The workshop page is only scraped if the workshop index 'index' doesn't know the image URL already, and
+    the details from the page are stored in the index. Thumbnails of images in map folders are kept in the image
+    cache too, so each image is only decoded once. 'base_url' replaces the workshop page URL, if given.
+    Folders that aren't named after a workshop ID, and items that weren't found in the last NOT_FOUND_TTL seconds, are
+    never looked up. Downloads count against 'limiter', a prefetch.RateLimiter, if given. Blocks, so it should be run
+    on a worker thread.
+    """
+
+    from scraper import (
+        BASE_URL, NOT_FOUND_TTL, WorkshopItem, ItemInfo, ItemNotFoundError, FetchError, download_img
+    )
+
+    path = entry.path.parent
+    if entry.preview is not None:
+        try:
+            key = thumbkey(entry.preview)
+            im = cache.get(key)
+            if im is None:
+                im = load_thumbnail(entry.preview, size)
+                cache.put(key, im)
+            return im
+        except OSError:
+            pass
+    im = cache.get(path.name)
+    if im is not None:
+        return im
+    workshop_id = path.name
+    if not workshop_id.isdigit():
+        return None
+    cached = index.getitem(workshop_id)
+    # Items that weren't found are stored without a title.
+    if cached is not None and cached.title is None and time.time() - (cached.fetched or 0) < NOT_FOUND_TTL:
+        diagnostics.count("notfound.hit")
+        return None
+    try:
+        im = None
+        if cached is not None and cached.preview_url:
+            try:
+                im = download_img(cached.preview_url, size=size, limiter=limiter)
+            except OSError:
+                pass
+        if im is None:
+            item = WorkshopItem(workshop_id, base_url=base_url or BASE_URL, cached=cached, limiter=limiter)
+            index.putitem(item.info)
+            # The item exists, so its details are kept, but there's nothing to show.
+            if item.preview_url is None:
+                return None
+            im = item.get_img(size)
+        im.thumbnail(size)
+    except FetchError:
+        return None
+    except ItemNotFoundError:
+        # Only raised for the page here, so the item doesn't exist.
+        index.putitem(ItemInfo(workshop_id, None, None, fetched=time.time()))
+        return None
+    except OSError:
+        # The image is damaged or isn't an image, or its download was cut off.
+        diagnostics.count("preview.badimage")
+        return None
+    cache.put(workshop_id, im)
+    return im
@@ -0,0 +1,26 @@
+import json
+import time
+
+
+# Reference point for startup times, taken when this module is first imported.
+START = time.perf_counter()
+
+
+class StartupTimer:
+    """Records how long each stage of startup took to be reached, in seconds since START."""
+
+    def __init__(self, start=START):
+        self.start = start
+        self.marks = {}
+
+    def mark(self, name):
+        self.marks[name] = round(time.perf_counter() - self.start, 4)
+
+    def report(self, path=None):
+        """Return the recorded times as a JSON line, and append it to the file at 'path' if given."""
+
+        line = json.dumps({"time": round(time.time()), **self.marks})
+        if path is not None:
+            with open(path, "a") as file:
+                file.write(line + "\n")
+        return line
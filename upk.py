@@ -0,0 +1,94 @@
+"""Read the summary at the start of Unreal Engine 3 package files, such as '.udk' maps and '.upk' packages.
+
+Only the first HEADER_BYTES of a file are mapped into memory, so checking a map costs the same whatever its size.
+"""
+
+from collections import namedtuple
+import mmap
+import os
+import struct
+
+
+# First four bytes of every package.
+PACKAGE_TAG = 0x9E2A83C1
+# Bytes mapped from the start of each file. The summary fields read here always fit in the first kilobyte.
+HEADER_BYTES = 4096
+# Counts above this are taken as signs of a damaged file rather than a real package.
+MAX_COUNT = 10 ** 7
+# Longest folder name accepted in the summary, in characters.
+MAX_FOLDER_NAME = 1024
+
+# Tag, file version, licensee version and total header size.
+_START = struct.Struct("<IHHi")
+# Package flags, then the count and offset of the names, exports and imports.
+_TABLES = struct.Struct("<Iiiiiii")
+
+PackageHeader = namedtuple("PackageHeader", "version licensee header_size names exports imports error")
+
+
+class PackageError(Exception):
+    pass
+
+
+def parseheader(data, size):
+    """Return a PackageHeader for the start of a package file 'data', of 'size' bytes in total.
+
+    Raises PackageError if it isn't an Unreal package, or its summary doesn't fit the file, as happens with maps whose
+    download was cut short.
+    """
+
+    if len(data) < _START.size:
+        raise PackageError("File is too short to be a map")
+    tag, version, licensee, header_size = _START.unpack_from(data)
+    if tag != PACKAGE_TAG:
+        raise PackageError("Not an Unreal package")
+    if not 0 < header_size <= size:
+        raise PackageError("Header is larger than the file, which may be incomplete")
+    offset = _START.size
+    try:
+        (length,) = struct.unpack_from("<i", data, offset)
+    except struct.error:
+        raise PackageError("Summary is incomplete")
+    # Negative lengths are UTF-16 strings, counted in characters.
+    if abs(length) > MAX_FOLDER_NAME:
+        raise PackageError("Summary is damaged")
+    offset += 4 + (length if length >= 0 else -2 * length)
+    try:
+        flags, names, name_offset, exports, export_offset, imports, import_offset = _TABLES.unpack_from(data, offset)
+    except struct.error:
+        raise PackageError("Summary is incomplete")
+    summary_end = offset + _TABLES.size
+    for count, table_offset in ((names, name_offset), (exports, export_offset), (imports, import_offset)):
+        if not 0 <= count <= MAX_COUNT:
+            raise PackageError("Summary is damaged")
+        if count and not summary_end <= table_offset < size:
+            raise PackageError("Tables lie past the end of the file, which may be incomplete")
+    return PackageHeader(version, licensee, header_size, names, exports, imports, None)
+
+
+def readheader(path):
+    """Return a PackageHeader for the package file at 'path', mapping only its first HEADER_BYTES into memory.
+
+    Raises PackageError if the file isn't a valid package, or OSError if it can't be read.
+    """
+
+    with open(path, "rb") as file:
+        size = os.fstat(file.fileno()).st_size
+        if not size:
+            raise PackageError("File is empty")
+        with mmap.mmap(file.fileno(), min(size, HEADER_BYTES), access=mmap.ACCESS_READ) as mm:
+            return parseheader(mm, size)
+
+
+def inspect(path):
+    """Return a PackageHeader for the file at 'path', with only 'error' set if it isn't a valid package.
+
+    Returns None if the file can't be read.
+    """
+
+    try:
+        return readheader(path)
+    except PackageError as e:
+        return PackageHeader(None, None, None, None, None, None, str(e))
+    except OSError:
+        return None
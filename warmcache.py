@@ -0,0 +1,87 @@
+import argparse
+import time
+
+import diagnostics
+from scraper import fetch_items, BASE_URL, ItemInfo, NOT_FOUND_TTL, WORKERS
+
+
+def workshop_ids(entries):
+    """Return the workshop IDs of the map folders of 'entries', without duplicates."""
+
+    return list(dict.fromkeys(e.path.parent.name for e in entries if e.path.parent.name.isdigit()))
+
+
+def warmcache(entries, cache, size, index=None, workers=WORKERS, base_url=BASE_URL, progress=None):
+    """Fetch the details and previews of all workshop maps in 'entries' that are missing from the caches.
+
+    Previews are downloaded for maps without an image in their folder that aren't in 'cache' yet. Details are stored
+    in the workshop index 'index', if given, for items it doesn't know yet. Items the index found not to exist in the
+    last NOT_FOUND_TTL seconds are skipped, and new ones are recorded. Items are fetched 'workers' at a time over one
+    pooled session. 'progress(done, total)' is called after each item finishes.
+    Returns the number of items fetched.
+    """
+
+    ids = workshop_ids(entries)
+    local = {e.path.parent.name for e in entries if e.preview is not None}
+    known = index.getitems(ids) if index is not None else {}
+    # Items that weren't found are stored without a title.
+    now = time.time()
+    absent = {
+        _id for _id, item in known.items() if item.title is None and now - (item.fetched or 0) < NOT_FOUND_TTL
+    }
+    if absent:
+        diagnostics.count("notfound.hit", len(absent))
+    ids = [_id for _id in ids if _id not in absent]
+    need_preview = {_id for _id in ids if _id not in local and _id not in cache}
+    missing = [_id for _id in ids if _id in need_preview or (index is not None and _id not in known)]
+
+    def fetched(item):
+        if index is not None:
+            index.putitem(item.info)
+        if item.id in need_preview and item.preview_url is not None:
+            im = item.get_img(size)
+            im.thumbnail(size)
+            cache.put(item.id, im)
+        return True
+
+    def notfound(_id):
+        if index is not None:
+            index.putitem(ItemInfo(_id, None, None, fetched=time.time()))
+
+    count = 0
+    results = fetch_items(missing, fetched, workers=workers, base_url=base_url, cached=known, notfound=notfound)
+    for done, (_id, ok) in enumerate(results, 1):
+        count += bool(ok)
+        if progress is not None:
+            progress(done, len(missing))
+    cache.flush()
+    return count
+
+
+if __name__ == "__main__":
+    from cache import DiskCache
+    from config import CACHE_FOLDER, DEFAULT_SETTINGS, INDEX_PATH, makefolders
+    from wkindex import WorkshopIndex
+
+    parser = argparse.ArgumentParser(description="Download the details and previews of every map in workshop folders.")
+    parser.add_argument("workshop_dirs", nargs="+", metavar="workshop_dir")
+    parser.add_argument("--workers", type=int, default=WORKERS)
+    parser.add_argument("--base-url", default=BASE_URL, help="workshop page URL, with %%s in place of the item ID")
+    parser.add_argument("--cache-mb", type=int, default=DEFAULT_SETTINGS["diskcachemb"])
+    args = parser.parse_args()
+
+    makefolders()
+    index = WorkshopIndex(INDEX_PATH)
+    roots = list(index.rescanall(args.workshop_dirs))
+    cache = DiskCache(CACHE_FOLDER, max_bytes=args.cache_mb * 1024 ** 2)
+    count = warmcache(
+        index.getmaps(roots),
+        cache,
+        size=(240, 158),
+        index=index,
+        workers=args.workers,
+        base_url=args.base_url,
+        progress=lambda done, total: print(f"\r{done}/{total}", end="", flush=True),
+    )
+    index.close()
+    print(f"\nFetched {count} workshop items")
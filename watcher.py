@@ -0,0 +1,253 @@
+"""Watch workshop directories for maps being added, removed or updated.
+
+On Linux, changes are reported by the kernel through inotify. Elsewhere, or when inotify can't watch a directory,
+the modification times of the map folders are polled, which is cheap on Windows because os.scandir gets them from
+the directory listing itself.
+"""
+
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import struct
+import sys
+import threading
+import time
+import traceback
+
+
+# inotify event flags, from <sys/inotify.h>.
+IN_ATTRIB = 0x4
+IN_CLOSE_WRITE = 0x8
+IN_MOVED_FROM = 0x40
+IN_MOVED_TO = 0x80
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_DELETE_SELF = 0x400
+IN_MOVE_SELF = 0x800
+IN_Q_OVERFLOW = 0x4000
+IN_IGNORED = 0x8000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+FOLDER_MASK = IN_CLOSE_WRITE | IN_ATTRIB | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+ROOT_MASK = FOLDER_MASK | IN_DELETE_SELF | IN_MOVE_SELF
+EVENT_HEADER = struct.Struct("iIII")
+
+
+def _loadinotify():
+    if not sys.platform.startswith("linux"):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        libc.inotify_init1.argtypes = [ctypes.c_int]
+        libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        libc.inotify_rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+    except (OSError, AttributeError):
+        return None
+    return libc
+
+
+class Watcher:
+    """Report changed map folders in workshop directories, on a background thread.
+
+    Changes are gathered into batches, so a burst of events, such as Steam downloading many maps at once, becomes one
+    call of 'callback(changes)'. A batch is sent once no new event has arrived for 'delay' seconds, or 'max_delay'
+    seconds after its first event. 'changes' maps each root with changes to a set of the folders that changed, which
+    may include the root itself for loose maps, or to None if the whole root has to be rescanned. Roots that can't be
+    watched with inotify are polled every 'poll' seconds.
+    """
+
+    def __init__(self, roots, callback, delay=0.5, max_delay=5.0, poll=5.0):
+        self.roots = [os.path.abspath(root) for root in dict.fromkeys(roots)]
+        self.callback = callback
+        self.delay = delay
+        self.max_delay = max_delay
+        self.poll = poll
+        self._stop = threading.Event()
+        self._thread = None
+        self._libc = _loadinotify()
+        self._fd = None
+        # Watched directory of each watch descriptor, and the root it belongs to.
+        self._watches = {}
+        # Folder modification times of polled roots, by root.
+        self._polled = {}
+
+    @property
+    def mode(self):
+        if not self._watches:
+            return "polling"
+        return "inotify+polling" if self._polled else "inotify"
+
+    def start(self):
+        """Start watching on a new thread, which also sets up the watches, so this returns at once."""
+
+        self._thread = threading.Thread(target=self._run, name="watcher", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Stop watching, without waiting for the thread to finish. No batches are sent after this returns."""
+
+        self._stop.set()
+
+    def join(self, timeout=None):
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _setup(self):
+        if self._libc is not None:
+            fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+            if fd >= 0:
+                self._fd = fd
+        for root in self.roots:
+            if self._stop.is_set():
+                return
+            if not self._watchroot(root):
+                self._polled[root] = self._pollfolders(root)
+
+    def _addwatch(self, path, root, mask):
+        wd = self._libc.inotify_add_watch(self._fd, os.fsencode(path), mask)
+        if wd < 0:
+            return ctypes.get_errno()
+        self._watches[wd] = (path, root)
+        return 0
+
+    def _watchroot(self, root):
+        """Watch 'root' and every folder in it with inotify. Returns False if it can't be, so it has to be polled."""
+
+        if self._fd is None:
+            return False
+        if self._addwatch(root, root, ROOT_MASK):
+            return False
+        try:
+            with os.scandir(root) as it:
+                folders = [entry.path for entry in it if entry.is_dir()]
+        except OSError:
+            folders = []
+        for path in folders:
+            error = self._addwatch(path, root, FOLDER_MASK)
+            # Out of watches: poll this root instead.
+            if error == errno.ENOSPC:
+                for wd in [wd for wd, (p, r) in self._watches.items() if r == root]:
+                    self._libc.inotify_rm_watch(self._fd, wd)
+                    del self._watches[wd]
+                return False
+        return True
+
+    def _readevents(self, changes):
+        """Add the folders changed by pending inotify events to 'changes'. Returns the number of events read."""
+
+        try:
+            data = os.read(self._fd, 64 * 1024)
+        except BlockingIOError:
+            return 0
+        count = 0
+        offset = 0
+        while offset < len(data):
+            wd, mask, cookie, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = os.fsdecode(data[offset:offset + length].rstrip(b"\0"))
+            offset += length
+            count += 1
+            if mask & IN_Q_OVERFLOW:
+                # Events were lost, so every root has to be rescanned.
+                for path, root in self._watches.values():
+                    changes[root] = None
+                continue
+            if mask & IN_IGNORED:
+                self._watches.pop(wd, None)
+                continue
+            watched = self._watches.get(wd)
+            if watched is None:
+                continue
+            path, root = watched
+            if path == root and mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+                changes[root] = None
+                continue
+            if changes.get(root, set()) is None:
+                continue
+            folders = changes.setdefault(root, set())
+            if path == root and mask & IN_ISDIR:
+                folder = os.path.join(root, name)
+                folders.add(folder)
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    self._addwatch(folder, root, FOLDER_MASK)
+            else:
+                folders.add(path)
+        return count
+
+    def _pollfolders(self, root):
+        """Return the modification times of 'root' and the folders in it, by path."""
+
+        try:
+            folders = {root: os.stat(root).st_mtime_ns}
+            with os.scandir(root) as it:
+                for entry in it:
+                    try:
+                        if entry.is_dir():
+                            folders[entry.path] = entry.stat().st_mtime_ns
+                    except OSError:
+                        continue
+        except OSError:
+            return {}
+        return folders
+
+    def _pollchanges(self, changes):
+        """Add the folders of polled roots that changed since the last poll to 'changes', and return their number."""
+
+        count = 0
+        for root, known in self._polled.items():
+            current = self._pollfolders(root)
+            changed = {path for path in known.keys() | current.keys() if known.get(path) != current.get(path)}
+            self._polled[root] = current
+            count += len(changed)
+            if changed and changes.get(root, set()) is not None:
+                changes.setdefault(root, set()).update(changed)
+        return count
+
+    def _run(self):
+        try:
+            self._setup()
+            self._watch()
+        finally:
+            if self._fd is not None:
+                os.close(self._fd)
+                self._fd = None
+            self._watches.clear()
+
+    def _watch(self):
+        changes = {}
+        first = last = None
+        next_poll = time.monotonic() + self.poll
+        while not self._stop.is_set():
+            now = time.monotonic()
+            timeout = next_poll - now if self._polled else self.poll
+            if first is not None:
+                timeout = min(timeout, last + self.delay - now, first + self.max_delay - now)
+            # Wake up at least twice a second to check for stop.
+            timeout = min(max(timeout, 0), 0.5)
+            events = 0
+            if self._fd is not None and self._watches:
+                if select.select([self._fd], [], [], timeout)[0]:
+                    events += self._readevents(changes)
+            else:
+                self._stop.wait(timeout)
+            now = time.monotonic()
+            if self._polled and now >= next_poll:
+                events += self._pollchanges(changes)
+                next_poll = now + self.poll
+            if events:
+                last = now
+                if first is None:
+                    first = now
+            if first is not None and (now - last >= self.delay or now - first >= self.max_delay):
+                batch, changes = changes, {}
+                first = last = None
+                if batch and not self._stop.is_set():
+                    try:
+                        self.callback(batch)
+                    except Exception:
+                        traceback.print_exc()
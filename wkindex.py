@@ -0,0 +1,402 @@
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+import os
+from pathlib import Path
+import sqlite3
+import threading
+
+import diagnostics
+from upk import PackageHeader
+
+
+# Image types that can be used as a map preview. Later types are preferred.
+PREVIEW_TYPES = (".png", ".jpg", ".jpeg", ".bmp")
+
+MapEntry = namedtuple("MapEntry", "name path size mtime preview")
+ItemRecord = namedtuple("ItemRecord", "id title preview_url fetched etag last_modified")
+
+
+def _rootkey(root):
+    return os.path.normcase(os.path.abspath(root))
+
+
+def _rootkeys(roots):
+    """Return the keys of 'roots', which is a single workshop directory or a list of them."""
+
+    if isinstance(roots, (str, os.PathLike)):
+        roots = [roots]
+    return list(dict.fromkeys(_rootkey(root) for root in roots))
+
+
+def _placeholders(keys):
+    return ", ".join("?" * len(keys))
+
+
+def _readfolder(path):
+    """Return the maps in the folder 'path' as (path, name, size, mtime) tuples and its preview, or None on error."""
+
+    udks = []
+    images = []
+    try:
+        with os.scandir(path) as it:
+            for entry in it:
+                ext = os.path.splitext(entry.name)[1].lower()
+                if ext == ".udk":
+                    try:
+                        stat = entry.stat()
+                    except OSError:
+                        continue
+                    udks.append((entry.path, entry.name, stat.st_size, stat.st_mtime_ns))
+                elif ext in PREVIEW_TYPES:
+                    images.append((PREVIEW_TYPES.index(ext), entry.name, entry.path))
+    except OSError:
+        return None
+    preview = max(images)[2] if images else None
+    return udks, preview
+
+
+class WorkshopIndex:
+    """Persistent index of the maps in workshop directories, stored in an SQLite database.
+
+    Each map folder is stored with its modification time, so a rescan only revisits folders that have changed.
+    Loose '.udk' files in the workshop directory itself are indexed under the directory's own entry.
+    Details scraped from workshop pages are stored by workshop ID, so titles can be shown without going online.
+    Content hashes are stored with the size and modification time of the file they were computed for, so each file
+    is only hashed again after it changes. Package headers are stored the same way, so maps can be checked and their
+    details shown without opening them. The time each map was last activated is kept too.
+    """
+
+    def __init__(self, db_path):
+        self.db = sqlite3.connect(str(db_path), check_same_thread=False)
+        self._lock = threading.Lock()
+        with self.db:
+            self.db.executescript("""
+                CREATE TABLE IF NOT EXISTS folders (
+                    path TEXT PRIMARY KEY,
+                    root TEXT NOT NULL,
+                    mtime INTEGER NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS maps (
+                    path TEXT PRIMARY KEY,
+                    folder TEXT NOT NULL,
+                    root TEXT NOT NULL,
+                    name TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    mtime INTEGER NOT NULL,
+                    preview TEXT
+                );
+                CREATE INDEX IF NOT EXISTS maps_root ON maps (root);
+                CREATE INDEX IF NOT EXISTS maps_folder ON maps (folder);
+                CREATE TABLE IF NOT EXISTS items (
+                    id TEXT PRIMARY KEY,
+                    title TEXT,
+                    preview_url TEXT,
+                    fetched REAL,
+                    etag TEXT,
+                    last_modified TEXT
+                );
+                CREATE TABLE IF NOT EXISTS activations (
+                    path TEXT PRIMARY KEY,
+                    time REAL NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS hashes (
+                    path TEXT PRIMARY KEY,
+                    size INTEGER NOT NULL,
+                    mtime INTEGER NOT NULL,
+                    hash TEXT NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS headers (
+                    path TEXT PRIMARY KEY,
+                    size INTEGER NOT NULL,
+                    mtime INTEGER NOT NULL,
+                    version INTEGER,
+                    licensee INTEGER,
+                    header_size INTEGER,
+                    names INTEGER,
+                    exports INTEGER,
+                    imports INTEGER,
+                    error TEXT
+                );
+            """)
+
+    def close(self):
+        with self._lock:
+            self.db.close()
+
+    @diagnostics.timed("scan")
+    def rescan(self, root):
+        """Bring the index for the workshop directory 'root' up to date.
+
+        Only folders whose modification time has changed since the last scan are read. The directory is read in a
+        single pass with os.scandir, and the database is only locked to store the results, so several roots can be
+        scanned at once. Returns the number of folders that were rescanned. Raises OSError if 'root' can't be read.
+        """
+
+        root = os.path.abspath(root)
+        key = _rootkey(root)
+        with self._lock:
+            known = dict(self.db.execute("SELECT path, mtime FROM folders WHERE root = ?", (key,)))
+        folders = [(root, os.stat(root).st_mtime_ns)]
+        with os.scandir(root) as it:
+            for entry in it:
+                try:
+                    if entry.is_dir():
+                        folders.append((entry.path, entry.stat().st_mtime_ns))
+                except OSError:
+                    continue
+        seen = {path for path, mtime in folders}
+        scanned = [
+            (path, mtime, _readfolder(path)) for path, mtime in folders if known.get(path) != mtime
+        ]
+        with self._lock, self.db:
+            for path in known.keys() - seen:
+                self.db.execute("DELETE FROM folders WHERE path = ?", (path,))
+                self.db.execute("DELETE FROM maps WHERE folder = ?", (path,))
+            for path, mtime, contents in scanned:
+                if contents is not None:
+                    self._storefolder(key, path, mtime, *contents)
+            if scanned:
+                self._prune()
+        return len(scanned)
+
+    def rescanall(self, roots, workers=None):
+        """Rescan several workshop directories in parallel, one worker per directory.
+
+        Roots usually live on different drives, so the total time is bounded by the slowest one.
+        Returns a dict mapping each root that could be read to the number of folders rescanned in it.
+        """
+
+        roots = list(dict.fromkeys(roots))
+        if not roots:
+            return {}
+
+        def scan(root):
+            try:
+                return self.rescan(root)
+            except OSError:
+                return None
+
+        with ThreadPoolExecutor(max_workers=workers or len(roots)) as executor:
+            counts = list(executor.map(scan, roots))
+        return {root: count for root, count in zip(roots, counts) if count is not None}
+
+    def updatefolders(self, root, folders):
+        """Bring the index up to date for only the map folders 'folders' in 'root', such as those a watcher reported.
+
+        Folders that no longer exist are removed. Returns a list of MapEntry tuples for the maps now in those folders.
+        """
+
+        key = _rootkey(root)
+        scanned = []
+        for path in folders:
+            path = os.path.abspath(path)
+            try:
+                mtime = os.stat(path).st_mtime_ns
+            except OSError:
+                scanned.append((path, None, None))
+                continue
+            scanned.append((path, mtime, _readfolder(path)))
+        with self._lock, self.db:
+            for path, mtime, contents in scanned:
+                if contents is None:
+                    self.db.execute("DELETE FROM folders WHERE path = ?", (path,))
+                    self.db.execute("DELETE FROM maps WHERE folder = ?", (path,))
+                else:
+                    self._storefolder(key, path, mtime, *contents)
+            self._prune()
+        return [
+            MapEntry(name, Path(p), size, m, preview and Path(preview))
+            for path, mtime, contents in scanned if contents is not None
+            for p, name, size, m in contents[0]
+            for preview in [contents[1]]
+        ]
+
+    def forgetothers(self, roots):
+        """Delete the folders and maps of every workshop directory except those in 'roots'.
+
+        Keeps the index from holding on to directories that are no longer configured, such as the partial paths seen
+        while one is typed in.
+        """
+
+        keys = _rootkeys(roots)
+        with self._lock, self.db:
+            self.db.execute(f"DELETE FROM folders WHERE root NOT IN ({_placeholders(keys)})", keys)
+            deleted = self.db.execute(f"DELETE FROM maps WHERE root NOT IN ({_placeholders(keys)})", keys).rowcount
+            if deleted:
+                self._prune()
+
+    def _prune(self):
+        """Delete the hashes and headers of maps that are no longer indexed."""
+
+        self.db.execute("DELETE FROM hashes WHERE path NOT IN (SELECT path FROM maps)")
+        self.db.execute("DELETE FROM headers WHERE path NOT IN (SELECT path FROM maps)")
+
+    def _storefolder(self, key, path, mtime, udks, preview):
+        self.db.execute("DELETE FROM maps WHERE folder = ?", (path,))
+        self.db.executemany(
+            "INSERT OR REPLACE INTO maps (path, folder, root, name, size, mtime, preview) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            [(p, path, key, name, size, m, preview) for p, name, size, m in udks],
+        )
+        self.db.execute("INSERT OR REPLACE INTO folders (path, root, mtime) VALUES (?, ?, ?)", (path, key, mtime))
+
+    def getmaps(self, roots):
+        """Return a list of MapEntry tuples for the indexed maps in 'roots', sorted by name.
+
+        'roots' is a workshop directory or a list of them, whose maps are merged into one list.
+        """
+
+        keys = _rootkeys(roots)
+        with self._lock:
+            rows = self.db.execute(
+                f"SELECT name, path, size, mtime, preview FROM maps WHERE root IN ({_placeholders(keys)})", keys
+            ).fetchall()
+        entries = [
+            MapEntry(name, Path(path), size, mtime, preview and Path(preview))
+            for name, path, size, mtime, preview in rows
+        ]
+        entries.sort(key=lambda e: e.name.lower())
+        return entries
+
+    def getitem(self, _id):
+        """Return the stored details of workshop item '_id' as an ItemRecord, or None if there aren't any."""
+
+        with self._lock:
+            row = self.db.execute(
+                "SELECT id, title, preview_url, fetched, etag, last_modified FROM items WHERE id = ?", (_id,)
+            ).fetchone()
+        return row and ItemRecord(*row)
+
+    def getitems(self, ids=None):
+        """Return a dict of stored ItemRecords by workshop ID, for all items or only those in 'ids'."""
+
+        with self._lock:
+            rows = self.db.execute("SELECT id, title, preview_url, fetched, etag, last_modified FROM items").fetchall()
+        if ids is not None:
+            ids = set(ids)
+            rows = [row for row in rows if row[0] in ids]
+        return {row[0]: ItemRecord(*row) for row in rows}
+
+    def putitem(self, info):
+        """Store the details of a workshop item, given as an object with the same attributes as an ItemRecord."""
+
+        with self._lock, self.db:
+            self.db.execute(
+                "INSERT OR REPLACE INTO items (id, title, preview_url, fetched, etag, last_modified) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (info.id, info.title, info.preview_url, info.fetched, info.etag, info.last_modified),
+            )
+
+    def getactivations(self):
+        """Return a dict mapping the paths of maps to the time they were last activated, as a Unix timestamp."""
+
+        with self._lock:
+            rows = self.db.execute("SELECT path, time FROM activations").fetchall()
+        return {Path(path): t for path, t in rows}
+
+    def putactivation(self, path, t):
+        """Record that the map at 'path' was activated at the Unix timestamp 't'."""
+
+        with self._lock, self.db:
+            self.db.execute("INSERT OR REPLACE INTO activations (path, time) VALUES (?, ?)", (str(path), t))
+
+    def gethashes(self, roots):
+        """Return a dict mapping the paths of maps in 'roots' to their content hashes, for maps that have one."""
+
+        keys = _rootkeys(roots)
+        with self._lock:
+            rows = self.db.execute(
+                "SELECT maps.path, hashes.hash FROM maps JOIN hashes ON hashes.path = maps.path "
+                f"AND hashes.size = maps.size AND hashes.mtime = maps.mtime WHERE maps.root IN ({_placeholders(keys)})",
+                keys,
+            ).fetchall()
+        return {Path(path): digest for path, digest in rows}
+
+    def unhashed(self, roots, shared_size=False):
+        """Return a list of MapEntry tuples for maps in 'roots' without an up to date content hash.
+
+        If 'shared_size' is True, only maps with the same size as another map in 'roots' are returned, since only
+        those can have duplicates.
+        """
+
+        keys = _rootkeys(roots)
+        marks = _placeholders(keys)
+        query = (
+            f"SELECT name, path, size, mtime, preview FROM maps WHERE root IN ({marks}) AND NOT EXISTS ("
+            "SELECT 1 FROM hashes WHERE hashes.path = maps.path AND hashes.size = maps.size "
+            "AND hashes.mtime = maps.mtime)"
+        )
+        args = keys
+        if shared_size:
+            query += f" AND size IN (SELECT size FROM maps WHERE root IN ({marks}) GROUP BY size HAVING COUNT(*) > 1)"
+            args = keys + keys
+        with self._lock:
+            rows = self.db.execute(query, args).fetchall()
+        return [
+            MapEntry(name, Path(path), size, mtime, preview and Path(preview))
+            for name, path, size, mtime, preview in rows
+        ]
+
+    def puthashes(self, entries, digests):
+        """Store content hashes for the map entries in 'entries', given by 'digests' as a dict of path to hash."""
+
+        rows = [
+            (str(e.path), e.size, e.mtime, digests[e.path]) for e in entries if digests.get(e.path) is not None
+        ]
+        with self._lock, self.db:
+            self.db.executemany(
+                "INSERT OR REPLACE INTO hashes (path, size, mtime, hash) VALUES (?, ?, ?, ?)", rows
+            )
+
+    def duplicates(self, roots):
+        """Return a list of groups of MapEntry tuples in 'roots' that have the same contents, across all roots."""
+
+        groups = {}
+        hashes = self.gethashes(roots)
+        for entry in self.getmaps(roots):
+            digest = hashes.get(entry.path)
+            if digest is not None:
+                groups.setdefault(digest, []).append(entry)
+        return [group for group in groups.values() if len(group) > 1]
+
+    def getheaders(self, roots):
+        """Return a dict mapping the paths of maps in 'roots' to their PackageHeaders, for maps that have one."""
+
+        keys = _rootkeys(roots)
+        with self._lock:
+            rows = self.db.execute(
+                "SELECT maps.path, version, licensee, header_size, names, exports, imports, error FROM maps "
+                "JOIN headers ON headers.path = maps.path AND headers.size = maps.size "
+                f"AND headers.mtime = maps.mtime WHERE maps.root IN ({_placeholders(keys)})",
+                keys,
+            ).fetchall()
+        return {Path(row[0]): PackageHeader(*row[1:]) for row in rows}
+
+    def uninspected(self, roots):
+        """Return a list of MapEntry tuples for maps in 'roots' without an up to date package header."""
+
+        keys = _rootkeys(roots)
+        with self._lock:
+            rows = self.db.execute(
+                f"SELECT name, path, size, mtime, preview FROM maps WHERE root IN ({_placeholders(keys)}) "
+                "AND NOT EXISTS (SELECT 1 FROM headers WHERE headers.path = maps.path "
+                "AND headers.size = maps.size AND headers.mtime = maps.mtime)",
+                keys,
+            ).fetchall()
+        return [
+            MapEntry(name, Path(path), size, mtime, preview and Path(preview))
+            for name, path, size, mtime, preview in rows
+        ]
+
+    def putheaders(self, entries, headers):
+        """Store package headers for the map entries in 'entries', given by 'headers' as a dict of path to header."""
+
+        rows = [
+            (str(e.path), e.size, e.mtime, *headers[e.path]) for e in entries if headers.get(e.path) is not None
+        ]
+        with self._lock, self.db:
+            self.db.executemany(
+                "INSERT OR REPLACE INTO headers "
+                "(path, size, mtime, version, licensee, header_size, names, exports, imports, error) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                rows,
+            )